@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+import argparse                 # for command line options
+import importlib.util           # for loading calculation-refactor.py
+import json                     # for saving results
+import os.path                  # for finding the refactor
+import random                   # for seeding Monte Carlo search
+import sys                      # for main args
+import tracemalloc              # for peak memory
+from time import time           # for performance
+
+import calculation
+
+"""
+Calculation Benchmarks
+
+Runs every solver on the same seeded decks for each deck size and reports
+how they did, so that changes to the search or heuristics can be compared
+run to run:
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json   # flag anything that got worse
+    python benchmark.py --quick-solve           # decks settled without a search
+
+Every deck gets the same node budget and time limit, so hard decks show up
+as unsolved instead of hanging the run.
+"""
+
+CARDS_PER_SUIT = (5, 7, 9, 13)
+
+# algorithm name -> (solver, heuristic)
+ALGORITHMS = {
+    "ida":                 ("ida", "priority"),
+    "parallel_ida":        ("parallel_ida", "priority"),
+    "bfs-priority":        ("bfs", "priority"),
+    "bfs-len_priority":    ("bfs", "len_priority"),
+    "bfs-old_priority":    ("refactor-bfs", "old_priority"),
+    "bfs-a_star_priority": ("refactor-bfs", "a_star_priority"),
+    "monte_carlo":         ("monte_carlo", "priority"),
+}
+
+def load_refactor():
+    """
+    calculation-refactor.py can't be imported by name, so load it by path
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calculation-refactor.py")
+    spec = importlib.util.spec_from_file_location("calculation_refactor", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+refactor = load_refactor()
+
+def corpus(cards_per_suit, n_decks, seed=0):
+    """
+    The benchmark decks for a deck size: always the same for the same seed
+    """
+    return calculation.seeded_decks(cards_per_suit, range(seed, seed+n_decks))
+
+def run_one(algorithm, cards_per_suit, deck, max_nodes=None, timeout=None):
+    """
+    Solves one deck, returning a dict with the status ("solved",
+    "unsolvable", "exhausted", "unsolved", "nodes", "timeout" or "error"),
+    nodes expanded, solution length, cards the best board got onto the
+    foundations and wall time
+    """
+    solver, heuristic = ALGORITHMS[algorithm]
+    start = time()
+    deadline = None if timeout is None else start + timeout
+    searcher = None
+    result = None
+    error = None
+    try:
+        if solver == "refactor-bfs":
+            # The refactor's deck leaves out the foundation cards and is
+            # drawn from the end
+            start_board = refactor.CalculationBoard(cards_per_suit, list(reversed(deck[4:])))
+            searcher = refactor.BFSSolver(start_board, getattr(refactor, heuristic),
+                                          max_nodes=max_nodes, deadline=deadline)
+            result = searcher.run()
+        else:
+            searcher = calculation.Calculation(cards_per_suit, deck, max_nodes=max_nodes,
+                                               deadline=deadline, verbose=False,
+                                               heuristic=heuristic)
+            result = searcher.solve(solver, rng=random.Random(0))
+        status = result.status
+    except Exception as e:
+        # A solver that can't handle a deck is a result too
+        status = "error"
+        error = repr(e)
+
+    if result is not None:
+        nodes = result.nodes
+    elif searcher is None:
+        nodes = 0
+    else:
+        nodes = searcher.nodes if solver == "refactor-bfs" else searcher.iters
+    board = None if result is None else result.board
+    run = {"status": status,
+           "nodes": nodes,
+           "moves": None if board is None else board.n_moves,
+           "progress": None if result is None or result.best is None else sum(result.best.found_lens),
+           "elapsed": time() - start}
+    if error is not None:
+        run["error"] = error
+    return run
+
+def peak_memory(algorithm, cards_per_suit, deck, max_nodes=None, timeout=None):
+    """
+    Runs the deck again under tracemalloc and returns the peak bytes. Kept
+    separate from run_one() since tracing slows everything down a lot.
+    """
+    tracemalloc.start()
+    try:
+        run_one(algorithm, cards_per_suit, deck, max_nodes, timeout)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def summarize(runs):
+    """
+    Totals for a list of run_one() results
+    """
+    solved = [r for r in runs if r["status"] == "solved"]
+    return {
+        "decks": len(runs),
+        "solve_rate": len(solved) / len(runs) if runs else 0,
+        "nodes": sum(r["nodes"] for r in runs),
+        "elapsed": sum(r["elapsed"] for r in runs),
+        "mean_moves": sum(r["moves"] for r in solved) / len(solved) if solved else None,
+        "peak_memory": max((r.get("peak_memory", 0) for r in runs), default=0),
+        "statuses": {s: sum(r["status"] == s for r in runs) for s in set(r["status"] for r in runs)},
+    }
+
+def run_benchmark(sizes=CARDS_PER_SUIT, algorithms=tuple(ALGORITHMS), n_decks=10, seed=0,
+                  max_nodes=20000, timeout=10, memory=True, log=print):
+    """
+    Runs every algorithm on every deck of each size's corpus. Returns
+    {cards_per_suit: {algorithm: {"summary": ..., "runs": [...]}}}
+    """
+    results = {}
+    for cards_per_suit in sizes:
+        decks = corpus(cards_per_suit, n_decks, seed)
+        results[str(cards_per_suit)] = by_algorithm = {}
+        for algorithm in algorithms:
+            runs = []
+            for deck in decks:
+                run = run_one(algorithm, cards_per_suit, deck, max_nodes, timeout)
+                if memory:
+                    run["peak_memory"] = peak_memory(algorithm, cards_per_suit, deck, max_nodes, timeout)
+                runs.append(run)
+            summary = summarize(runs)
+            by_algorithm[algorithm] = {"summary": summary, "runs": runs}
+            if log:
+                log(format_summary(cards_per_suit, algorithm, summary))
+    return results
+
+def quick_solve_corpus(sizes=CARDS_PER_SUIT, n_decks=10, seed=0, log=print):
+    """
+    Runs Calculation.quick_verdict() on every deck of each size's corpus.
+    Returns {cards_per_suit: {"lost": n, "won": n, "searched": n, "nodes":
+    n, "elapsed": seconds}}, where searched is how many decks it couldn't
+    settle.
+    """
+    results = {}
+    for cards_per_suit in sizes:
+        counts = {"lost": 0, "won": 0, "searched": 0, "nodes": 0, "elapsed": 0}
+        start = time()
+        for deck in corpus(cards_per_suit, n_decks, seed):
+            game = calculation.Calculation(cards_per_suit, deck, verbose=False)
+            verdict, board = game.quick_verdict()
+            counts[verdict or "searched"] += 1
+            counts["nodes"] += game.iters
+        counts["elapsed"] = time() - start
+        results[str(cards_per_suit)] = counts
+        if log:
+            log("{:>3} quick solve  lost {:>4}  won {:>4}  searched {:>4}  nodes {:>6}  time {:>6.2f}s".format(
+                cards_per_suit, counts["lost"], counts["won"], counts["searched"],
+                counts["nodes"], counts["elapsed"]))
+    return results
+
+def format_summary(cards_per_suit, algorithm, summary):
+    mean_moves = "-" if summary["mean_moves"] is None else "{:.1f}".format(summary["mean_moves"])
+    return "{:>3} {:<20} solved {:>4.0%}  nodes {:>8}  time {:>8.2f}s  moves {:>5}  peak {:>7.1f}KiB".format(
+        cards_per_suit, algorithm, summary["solve_rate"], summary["nodes"], summary["elapsed"],
+        mean_moves, summary["peak_memory"] / 1024)
+
+def compare(results, baseline, tolerance=0.1, slack=0.1):
+    """
+    Lists every (size, algorithm, metric) that got worse than baseline by
+    more than tolerance (as a fraction). Solve rates are compared exactly,
+    and times that moved by less than slack seconds are left alone since
+    they're mostly noise.
+    """
+    regressions = []
+    for size, by_algorithm in results.items():
+        for algorithm, result in by_algorithm.items():
+            old = baseline.get(size, {}).get(algorithm)
+            if old is None:
+                continue
+            new, old = result["summary"], old["summary"]
+            if new["solve_rate"] < old["solve_rate"]:
+                regressions.append((size, algorithm, "solve_rate", old["solve_rate"], new["solve_rate"]))
+            for metric in ("nodes", "elapsed", "peak_memory"):
+                if metric == "elapsed" and new[metric] - old[metric] < slack:
+                    continue
+                if old[metric] and new[metric] > old[metric] * (1 + tolerance):
+                    regressions.append((size, algorithm, metric, old[metric], new[metric]))
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the Calculation solvers")
+    parser.add_argument("--sizes", type=int, nargs="+", default=CARDS_PER_SUIT,
+                        help="cards per suit to benchmark")
+    parser.add_argument("--algorithms", nargs="+", default=list(ALGORITHMS), choices=list(ALGORITHMS))
+    parser.add_argument("--decks", type=int, default=10, help="decks per size")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first deck")
+    parser.add_argument("--max-nodes", type=int, default=20000, help="node budget per deck")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds per deck")
+    parser.add_argument("--quick-solve", action="store_true",
+                        help="only report how many decks Calculation.quick_verdict() settles")
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory runs")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved with --output")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="how much worse (fraction) counts as a regression")
+    args = parser.parse_args(argv[1:])
+
+    if args.quick_solve:
+        quick_solve_corpus(args.sizes, args.decks, args.seed)
+        return 0
+
+    results = run_benchmark(args.sizes, args.algorithms, args.decks, args.seed,
+                            args.max_nodes, args.timeout, not args.no_memory)
+
+    if args.output:
+        config = {k: v for k, v in vars(args).items() if k not in ("output", "baseline")}
+        with open(args.output, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=1)
+        print("Wrote", args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for size, algorithm, metric, old, new in regressions:
+            print("REGRESSION {} {} {}: {:.4g} -> {:.4g}".format(size, algorithm, metric, old, new))
+        if regressions:
+            return 1
+        print("No regressions against", args.baseline)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,10 +1,18 @@
 #!/usr/bin/env python
+import argparse                          # for command line options
 import random                            # for shuffling
-from copy import deepcopy                # for static board states
+import sys                               # for main args
 from collections import namedtuple       # for simple classes
-from queue import PriorityQueue          # for BFSSolver board ordering
-from dataclasses import dataclass, field # for prioritizing boards
+from functools import lru_cache          # for sharing tables between boards
 from math import inf                     # for max threshold
+from time import time                    # for solver deadlines
+from search import TranspositionTable, zobrist_keys # for duplicate boards
+from search import frontiers             # for BFSSolver board ordering
+from search import BudgetExceeded, SearchResult # for giving up on long solves
+try:
+    import numpy as np                   # for playing games in batches
+except ImportError:
+    np = None
 
 """
 Calculation Player
@@ -25,27 +33,37 @@ class CalculationBoard:
     A CalculationBoard keeps the state of a calculation game.
     There are 4 foundations, 4 waste piles, and a deck of cards to draw from.
     The calculation board is a snapshot of where all the cards are.
+
+    Boards are immutable so that applying a move never has to deepcopy.
+    Foundations are always a prefix of their winning sequence, so only their
+    lengths are stored. Wastes are a tuple of tuples, and the deck is a tuple
+    shared by every board of a game plus the number of cards still in it.
+    Each board carries its zobrist hash (zhash), which applying a move
+    updates instead of recomputing. Moves are kept as a chain of
+    (move, previous history) pairs shared with the parent board, and only
+    turned back into a list when board.moves is asked for.
     """
 
     NUM_WASTES = NUM_FOUNDATIONS = NUM_SUITS = 4
 
+    __slots__ = ("cards_per_suit", "tables", "found_lens",
+                 "wastes", "full_deck", "deck_len", "history", "n_moves", "zhash")
+
     class PileTypes:
         FOUNDATION = "F"
         WASTE = "W"
         DECK = "D"
 
-    class CardLocation:
-        def __init__(self, pile_type=None, pile_index=None):
-            self.pile_type = pile_type
-            self.pile_index = pile_index
+    # Locations and moves are immutable, so every one there can be is made
+    # once (see the end of the class) and shared by every board
+    class CardLocation(namedtuple("CardLocation", ["pile_type", "pile_index"], defaults=(None, None))):
+        __slots__ = ()
 
         def __repr__(self):
             return "{type}{index}".format(type=self.pile_type, index=self.pile_index)
 
-    class Move:
-        def __init__(self, src=None, dest=None):
-            self.src = src
-            self.dest = dest
+    class Move(namedtuple("Move", ["src", "dest"], defaults=(None, None))):
+        __slots__ = ()
 
         def __repr__(self):
             return "({src} -> {dest})".format(src=self.src, dest=self.dest)
@@ -57,25 +75,57 @@ class CalculationBoard:
     # they were relics of tree-searching, but that may not be necessary.
     def __init__(self, cards_per_suit=13, deck=None):
         self.cards_per_suit = cards_per_suit
-        self.foundations = [[i] for i in range(1, 1+CalculationBoard.NUM_FOUNDATIONS)]
-        self.wastes = [[] for i in range(CalculationBoard.NUM_WASTES)]
+        self.found_lens = (1,) * CalculationBoard.NUM_FOUNDATIONS
+        self.wastes = ((),) * CalculationBoard.NUM_WASTES
+
+        self.tables = foundation_tables(cards_per_suit)
+
+        self.full_deck = tuple(deck if deck else CalculationBoard.generate_random_deck(cards_per_suit))
+        self.deck_len = len(self.full_deck)
+
+        self.history = None
+        self.n_moves = 0
+
+        keys = zobrist_keys(cards_per_suit)
+        self.zhash = keys.deck[self.deck_len]
+        for f in range(CalculationBoard.NUM_FOUNDATIONS):
+            self.zhash ^= keys.found[f][1]
 
-        self.card_values = list(range(1, cards_per_suit)) + [0]
-        self.winning = [[(base*i)%cards_per_suit for i in self.card_values] for base in range(1, 1+CalculationBoard.NUM_FOUNDATIONS)]
+    @property
+    def moves(self):
+        moves = []
+        history = self.history
+        while history is not None:
+            move, history = history
+            moves.append(move)
+        moves.reverse()
+        return moves
 
-        self.deck = deck if deck else CalculationBoard.generate_random_deck(cards_per_suit)
+    @property
+    def card_values(self):
+        return self.tables.card_values
 
-        self.moves = []
+    @property
+    def winning(self):
+        return self.tables.winning
+
+    @property
+    def foundations(self):
+        return [list(win[:n]) for win, n in zip(self.winning, self.found_lens)]
+
+    @property
+    def deck(self):
+        return list(self.full_deck[:self.deck_len])
 
     def __eq__(self, other):
-        return self.foundations == other.foundations and self.wastes == other.wastes and self.deck == other.deck
+        return self.zhash == other.zhash and self.found_lens == other.found_lens and self.wastes == other.wastes and self.deck_len == other.deck_len and self.full_deck == other.full_deck
 
     def __repr__(self):
-        return str([self.foundations, self.wastes, self.deck])
+        return str([self.foundations, [list(w) for w in self.wastes], self.deck])
 
     # So it can be used in sets
     def __hash__(self):
-        return hash(str(self))
+        return self.zhash
 
     @staticmethod
     def generate_random_deck(cards_per_suit):
@@ -88,7 +138,48 @@ class CalculationBoard:
         return deck
 
     def is_winning(self):
-        return self.foundations == self.winning
+        return all(n == self.cards_per_suit for n in self.found_lens)
+
+    def is_lost(self):
+        """
+        True if the board can never be won:
+            - some card is still needed more times than there are copies left
+            - a waste card isn't needed by any foundation any more
+            - a waste card sits on a card that every foundation still needing
+              it needs first, and every copy of that lower card left is
+              buried under it
+        """
+        foundations = range(CalculationBoard.NUM_FOUNDATIONS)
+        for card in set(self.card_values):
+            needed = sum(self.needed_at(j, card) is not None for j in foundations)
+            if needed > self.copies_left(card):
+                return True
+
+        for waste in self.wastes:
+            for over, card in enumerate(waste):
+                places = [(j, self.needed_at(j, card)) for j in foundations]
+                places = [(j, pos) for j, pos in places if pos is not None]
+                if not places:
+                    return True
+                for under in range(over):
+                    lower = waste[under]
+                    lower_first = all(self.needed_at(j, lower) is not None and self.needed_at(j, lower) < pos
+                                      for j, pos in places)
+                    if lower_first and self.copies_left(lower) == waste[:over].count(lower):
+                        return True
+        return False
+
+    def needed_at(self, foundation_index, card):
+        """
+        Where card still has to go in the foundation, or None if it doesn't
+        """
+        return self.tables.needed[foundation_index][self.found_lens[foundation_index]][card]
+
+    def copies_left(self, card):
+        """
+        Copies of card in the deck or waste piles
+        """
+        return self.full_deck[:self.deck_len].count(card) + sum(waste.count(card) for waste in self.wastes)
 
     def get_possible_moves(self):
         moves_from_waste_piles = self.get_possible_moves_from_waste()
@@ -96,15 +187,8 @@ class CalculationBoard:
         return moves_from_waste_piles + moves_from_deck
 
     def can_play_on_foundation(self, card_to_play, foundation_index):
-        foundation = self.foundations[foundation_index]
-
-        # If we've already reached king, that pile's already done. Can't play any more
-        top_card = foundation[-1]
-        if top_card == 0:
-            return False
-
-        base_card = foundation[0]
-        expected_next = (top_card + base_card) % self.cards_per_suit
+        # None once the pile has reached a king, so nothing matches
+        expected_next = self.tables.next_needed[foundation_index][self.found_lens[foundation_index]]
         return card_to_play == expected_next
 
     def get_possible_moves_from_waste(self):
@@ -113,67 +197,123 @@ class CalculationBoard:
         foundations. Returns a list of Moves.
         """
         possible_moves = []
-        for i in range(len(self.wastes)):
-            waste = self.wastes[i]
+        next_needed = self.tables.next_needed
+        for i, waste in enumerate(self.wastes):
             if not waste:
                 continue
 
-            src = CalculationBoard.CardLocation(pile_type=CalculationBoard.PileTypes.WASTE, pile_index=i)
             src_card = waste[-1]
-            for j in range(len(self.foundations)):
-                dest = CalculationBoard.CardLocation(pile_type=CalculationBoard.PileTypes.FOUNDATION, pile_index=j)
-                if self.can_play_on_foundation(src_card, j):
-                    possible_moves.append(CalculationBoard.Move(src=src, dest=dest))
+            for j, length in enumerate(self.found_lens):
+                if next_needed[j][length] == src_card:
+                    possible_moves.append(CalculationBoard.WASTE_TO_FOUNDATION[i][j])
 
         return possible_moves
 
     def get_possible_moves_from_deck(self):
         possible_moves = []
-        if not self.deck:
+        if not self.deck_len:
             return possible_moves
 
-        src_card = self.deck[-1]
-        src = CalculationBoard.CardLocation(pile_type=CalculationBoard.PileTypes.DECK, pile_index=0)
+        src_card = self.full_deck[self.deck_len-1]
+        next_needed = self.tables.next_needed
 
         # deck to foundations
-        for j in range(len(self.foundations)):
-            dest = CalculationBoard.CardLocation(pile_type=CalculationBoard.PileTypes.FOUNDATION, pile_index=j)
-            if self.can_play_on_foundation(src_card, j):
-                possible_moves.append(CalculationBoard.Move(src=src, dest=dest))
+        for j, length in enumerate(self.found_lens):
+            if next_needed[j][length] == src_card:
+                possible_moves.append(CalculationBoard.DECK_TO_FOUNDATION[j])
 
         # deck to waste --> all waste are playable
-        for i in range(len(self.wastes)):
-            dest = CalculationBoard.CardLocation(pile_type=CalculationBoard.PileTypes.WASTE, pile_index=i)
-            possible_moves.append(CalculationBoard.Move(src=src, dest=dest))
+        possible_moves.extend(CalculationBoard.DECK_TO_WASTE)
 
         return possible_moves
 
     @staticmethod
     def apply_move_to_board(board, move):
-        new_board = deepcopy(board) # immutable, avoid changing
+        # Boards are immutable, so only the piles touched by the move are rebuilt
+        found_lens = board.found_lens
+        wastes = board.wastes
+        deck_len = board.deck_len
+        keys = zobrist_keys(board.cards_per_suit)
+        zhash = board.zhash
 
         src = move.src
         if src.pile_type == CalculationBoard.PileTypes.DECK:
-            card = new_board.deck.pop()
+            zhash ^= keys.deck[deck_len] ^ keys.deck[deck_len-1]
+            deck_len -= 1
+            card = board.full_deck[deck_len]
         elif src.pile_type == CalculationBoard.PileTypes.WASTE:
-            card = new_board.wastes[src.pile_index].pop()
+            card = wastes[src.pile_index][-1]
+            zhash ^= keys.waste[src.pile_index][len(wastes[src.pile_index])-1][card]
+            wastes = wastes[:src.pile_index] + (wastes[src.pile_index][:-1],) + wastes[src.pile_index+1:]
         else:
-            raise InvalidMoveException("Unexpected move source pile type: {}".format(src.pile_type))
+            raise CalculationBoard.InvalidMoveException("Unexpected move source pile type: {}".format(src.pile_type))
         
         dest = move.dest
         if dest.pile_type == CalculationBoard.PileTypes.FOUNDATION:
-            new_board.foundations[dest.pile_index].append(card)
+            i = dest.pile_index
+            zhash ^= keys.found[i][found_lens[i]] ^ keys.found[i][found_lens[i]+1]
+            found_lens = found_lens[:i] + (found_lens[i]+1,) + found_lens[i+1:]
         elif dest.pile_type == CalculationBoard.PileTypes.WASTE:
-            new_board.wastes[dest.pile_index].append(card)
+            i = dest.pile_index
+            zhash ^= keys.waste[i][len(wastes[i])][card]
+            wastes = wastes[:i] + (wastes[i] + (card,),) + wastes[i+1:]
         else:
-            raise InvalidMoveException("Unexpected move dest pile type: {}".format(dest.pile_type))
-
-        new_board.moves.append(move)
+            raise CalculationBoard.InvalidMoveException("Unexpected move dest pile type: {}".format(dest.pile_type))
+
+        new_board = CalculationBoard.__new__(CalculationBoard)
+        new_board.cards_per_suit = board.cards_per_suit
+        new_board.tables = board.tables
+        new_board.found_lens = found_lens
+        new_board.wastes = wastes
+        new_board.full_deck = board.full_deck
+        new_board.deck_len = deck_len
+        new_board.history = (move, board.history)
+        new_board.n_moves = board.n_moves + 1
+        new_board.zhash = zhash
 
         return new_board
 
 
 
+# Every location and move, made once
+CalculationBoard.DECK = CalculationBoard.CardLocation(CalculationBoard.PileTypes.DECK, 0)
+CalculationBoard.FOUNDATION_PILES = tuple(CalculationBoard.CardLocation(CalculationBoard.PileTypes.FOUNDATION, j)
+                                          for j in range(CalculationBoard.NUM_FOUNDATIONS))
+CalculationBoard.WASTE_PILES = tuple(CalculationBoard.CardLocation(CalculationBoard.PileTypes.WASTE, i)
+                                     for i in range(CalculationBoard.NUM_WASTES))
+CalculationBoard.WASTE_TO_FOUNDATION = tuple(tuple(CalculationBoard.Move(waste, foundation)
+                                                   for foundation in CalculationBoard.FOUNDATION_PILES)
+                                             for waste in CalculationBoard.WASTE_PILES)
+CalculationBoard.DECK_TO_FOUNDATION = tuple(CalculationBoard.Move(CalculationBoard.DECK, foundation)
+                                            for foundation in CalculationBoard.FOUNDATION_PILES)
+CalculationBoard.DECK_TO_WASTE = tuple(CalculationBoard.Move(CalculationBoard.DECK, waste)
+                                       for waste in CalculationBoard.WASTE_PILES)
+
+FoundationTables = namedtuple("FoundationTables", ["card_values", "winning", "next_needed", "needed"])
+
+@lru_cache(maxsize=None)
+def foundation_tables(cards_per_suit):
+    """
+    The foundation lookups for a deck size, built once and shared by every
+    board:
+        winning[f]          the cards foundation f takes, in order
+        next_needed[f][n]   the card foundation f takes when it holds n
+                            cards, or None once it has reached a king
+        needed[f][n][card]  where card still has to go in foundation f when
+                            it holds n cards, or None if it doesn't
+    """
+    card_values = tuple(range(1, cards_per_suit)) + (0,)
+    winning = tuple(tuple((base*i)%cards_per_suit for i in card_values)
+                    for base in range(1, 1+CalculationBoard.NUM_FOUNDATIONS))
+    next_needed = tuple(tuple(win[n] if n < cards_per_suit and win[n-1] != 0 else None
+                              for n in range(cards_per_suit+1))
+                        for win in winning)
+    needed = tuple(tuple(tuple(next((pos for pos in range(n, cards_per_suit) if win[pos] == card), None)
+                               for card in range(cards_per_suit))
+                         for n in range(cards_per_suit+1))
+                   for win in winning)
+    return FoundationTables(card_values, winning, next_needed, needed)
+
 
 class CalculationPlayer:
     def choose_best_move(self, possible_moves):
@@ -184,8 +324,14 @@ class CalculationPlayer:
         pass
 
 class RandomPlayer(CalculationPlayer):
+    def __init__(self, rng=random):
+        # Give each game its own random.Random to be able to replay it
+        self.rng = rng
+
     def choose_best_move(self, possible_moves):
-        return random.choice(possible_moves)
+        # Like rng.choice, but with one rng.random() per move so that
+        # play_games can draw the same numbers ahead of time
+        return possible_moves[int(self.rng.random() * len(possible_moves))]
 
 class GreedyPlayer(CalculationPlayer):
     def choose_best_move(self, possible_moves):
@@ -205,27 +351,87 @@ class GreedyPlayer(CalculationPlayer):
 
 
 class CalculationSolver:
-  def __init__(self, board):
-    self.starting_board = deepcopy(board)
-    self.played = set()
-    self.limit = (board.NUM_SUITS * board.cards_per_suit) ** 5
+  def __init__(self, board, table_size=None, eviction="lru", max_nodes=None, deadline=None,
+               stats=None):
+    self.starting_board = board # boards are immutable, no need to copy
+    # Fewest moves each board was reached in, bounded by table_size if given
+    self.played = TranspositionTable(table_size, eviction)
+    self.pruned = 0 # boards skipped because they were already lost
+    self.dropped = 0 # boards a full frontier threw away, so a loss isn't a proof
+    self.nodes = 0  # boards expanded
+    # The board with the most cards on the foundations so far
+    self.best = board
+    # Give up (BudgetExceeded) after max_nodes boards or once time() passes deadline
+    self.max_nodes = max_nodes
+    self.deadline = deadline
+    # Optional SearchStats; children() and table lookups are only timed then
+    self.stats = stats
+    if stats is not None:
+      self.children = stats.timed("children", self.children, tally="generated")
+      stats.watch_table(self.played)
 
   def solve(self):
     pass
 
-@dataclass(order=True)
-class PrioritizedBoard:
-  priority: int
-  board: CalculationBoard=field(compare=False)
+  def run(self):
+    """
+    solve(), but returning a SearchResult instead of raising BudgetExceeded.
+    A search that ends without a win is "unsolvable", unless it dropped
+    boards on the way ("exhausted").
+    """
+    start = time()
+    board = None
+    try:
+      end = self.solve()
+    except BudgetExceeded as e:
+      status = e.args[0]
+    else:
+      if end.is_winning():
+        status, board = "solved", end
+      elif self.dropped:
+        status = "exhausted"
+      else:
+        status = "unsolvable"
+    return SearchResult(status, board, self.best if board is None else board, self.nodes,
+                        time()-start, None if self.stats is None else self.stats.counts())
+
+  def children(self, board):
+    """
+    Every board one move away from board
+    """
+    return [CalculationBoard.apply_move_to_board(board, move)
+            for move in CalculationBoard.get_possible_moves(board)]
+
+  def prune(self):
+    """
+    Called for every board skipped because it's already lost
+    """
+    self.pruned += 1
+    if self.stats is not None:
+      self.stats.pruned += 1
+
+  def visit(self, board):
+    """
+    Called for every board the solver expands
+    """
+    self.nodes += 1
+    if sum(board.found_lens) > sum(self.best.found_lens):
+      self.best = board
+    if self.stats is not None:
+      self.stats.expand()
+    if self.max_nodes is not None and self.nodes > self.max_nodes:
+      raise BudgetExceeded("nodes")
+    if self.deadline is not None and self.nodes % 256 == 0 and time() > self.deadline:
+      raise BudgetExceeded("timeout")
 
 def old_priority(board):
-  foundation_lens = list(map(len, board.foundations))
+  foundation_lens = board.found_lens
   waste_lens = list(map(len, board.wastes))
   
   progress = sum(foundation_lens)
   
   deck_size = board.cards_per_suit * CalculationBoard.NUM_SUITS
-  distance = deck_size - len(board.deck)
+  distance = deck_size - board.deck_len
   
   foundation_diff = max(foundation_lens) - min(foundation_lens)
   waste_diff = max(waste_lens) - min(waste_lens)
@@ -237,12 +443,12 @@ def old_priority(board):
 
 def distance_traveled(board):
     deck_size = board.cards_per_suit * CalculationBoard.NUM_SUITS
-    played_so_far = deck_size - len(board.deck)
+    played_so_far = deck_size - board.deck_len
     return played_so_far
 
 def distance_to_go(board):
     deck_size = board.cards_per_suit * CalculationBoard.NUM_SUITS
-    num_in_foundations = sum(map(len, board.foundations))
+    num_in_foundations = sum(board.found_lens)
     distance_from_goal = deck_size - num_in_foundations
     return distance_from_goal
 
@@ -250,32 +456,44 @@ def a_star_priority(board):
     return distance_traveled(board) + distance_to_go(board)
 
 class BFSSolver(CalculationSolver):
-  def __init__(self, board, priority_func):
-    super().__init__(board)
+  def __init__(self, board, priority_func, table_size=None, eviction="lru",
+               frontier="heap", frontier_size=None, **budget):
+    super().__init__(board, table_size, eviction, **budget)
     self.priority = priority_func
+    if self.stats is not None:
+      self.priority = self.stats.timed("priority", priority_func)
+    # "bucket" suits the small integer priorities, e.g. a_star_priority
+    self.frontier = frontier
+    self.frontier_size = frontier_size
 
   def solve(self):
-    boards = PriorityQueue()
+    boards = frontiers[self.frontier](self.frontier_size)
     board = self.starting_board
-    pb = PrioritizedBoard(self.priority(board), board)
-    boards.put(pb)
-
-    while boards and len(self.played) <= self.limit:
-      pb = boards.get()
-      board = pb.board
-      self.played.add(board)
+    if board.is_lost():
+      self.prune()
+      return board
+    boards.push(board, self.priority(board), board)
+
+    while boards:
+      _, board = boards.pop()
+      if self.played.seen(board.zhash, board.n_moves):
+        continue
+      self.played.put(board.zhash, board.n_moves, board.deck_len)
+      self.visit(board)
 
       # print(str(board))
 
       if board.is_winning():
         return board
 
-      for move in CalculationBoard.get_possible_moves(board):
-        child_board = CalculationBoard.apply_move_to_board(board, move)
-        if child_board not in self.played:
-          pb = PrioritizedBoard(self.priority(child_board), child_board)
-          boards.put(pb)
+      for child_board in self.children(board):
+        if child_board.is_lost():
+          self.prune()
+          continue
+        if not self.played.seen(child_board.zhash, child_board.n_moves):
+          boards.push(child_board, self.priority(child_board), child_board)
 
+    self.dropped += boards.pruned
     return board
 
 def play_game(board, player):
@@ -299,6 +517,101 @@ def play_game(board, player):
     return True
     # TODO: keep track of moves
 
+def play_games(decks, policy, cards_per_suit=13, seeds=None):
+    """
+    Plays a whole batch of games at once, with the state of every game kept
+    in NumPy arrays and every game moving one step per pass. policy is
+    "random" (RandomPlayer) or "greedy" (GreedyPlayer). Game i plays decks[i]
+    and, for "random", makes the same choices as
+    play_game(CalculationBoard(cards_per_suit, decks[i]), RandomPlayer(random.Random(seeds[i])))
+    (seeds defaults to 0, 1, 2, ...).
+    Returns (won, n_moves): an array of win flags and one of move counts.
+    """
+    if np is None:
+        raise ImportError("play_games needs numpy")
+    if policy not in ("random", "greedy"):
+        raise ValueError("Unknown policy: {}".format(policy))
+
+    decks = np.array(decks, dtype=np.int16)  # small cards keep big batches small
+    n_games, deck_size = decks.shape
+    foundations = np.arange(CalculationBoard.NUM_FOUNDATIONS)
+    wastes_i = np.arange(CalculationBoard.NUM_WASTES)
+
+    # next_card[f][length] = the card foundation f takes when it holds length
+    # cards, or -1 if it's done (same as can_play_on_foundation)
+    next_card = np.array([[-1 if card is None else card for card in needs]
+                          for needs in foundation_tables(cards_per_suit).next_needed], dtype=np.int64)
+
+    if policy == "random":
+        # Every move draws one number, and a game can't take more than two
+        # moves per card (drawn, then off a waste heap), so draw them all now
+        if seeds is None:
+            seeds = range(n_games)
+        rng = random.Random()
+        draws = np.empty((n_games, 2 * deck_size))
+        for i, seed in enumerate(seeds):
+            rng.seed(seed)
+            draws[i] = [rng.random() for _ in range(2 * deck_size)]
+
+    found_lens = np.ones((n_games, CalculationBoard.NUM_FOUNDATIONS), dtype=np.int64)
+    wastes = np.zeros((n_games, CalculationBoard.NUM_WASTES, deck_size), dtype=np.int16)
+    heights = np.zeros((n_games, CalculationBoard.NUM_WASTES), dtype=np.int64)
+    deck_lens = np.full(n_games, deck_size, dtype=np.int64)
+    won = np.zeros(n_games, dtype=bool)
+    n_moves = np.zeros(n_games, dtype=np.int64)
+
+    playing = np.arange(n_games)
+    while True:
+        finished = (found_lens[playing] == cards_per_suit).all(axis=1)
+        won[playing[finished]] = True
+        playing = playing[~finished]
+        if not len(playing):
+            break
+
+        # Moves in get_possible_moves order: waste i -> foundation j (16),
+        # deck -> foundation j (4), deck -> waste i (4)
+        needs = next_card[foundations, found_lens[playing]]
+        height = heights[playing]
+        tops = wastes[playing[:, None], wastes_i, np.maximum(height-1, 0)]
+        tops = np.where(height > 0, tops, -2)
+        has_deck = deck_lens[playing] > 0
+        drawn = np.where(has_deck, decks[playing, np.maximum(deck_lens[playing]-1, 0)], -2)
+        legal = np.concatenate([
+            (tops[:, :, None] == needs[:, None, :]).reshape(len(playing), -1),
+            drawn[:, None] == needs,
+            np.repeat(has_deck[:, None], CalculationBoard.NUM_WASTES, axis=1),
+        ], axis=1)
+
+        # Games with no moves left are lost
+        n_legal = legal.sum(axis=1)
+        stuck = n_legal == 0
+        playing = playing[~stuck]
+        legal, n_legal, drawn = legal[~stuck], n_legal[~stuck], drawn[~stuck]
+
+        if policy == "greedy":
+            # Every foundation move comes before every waste move, so the
+            # first legal move is the one GreedyPlayer's stable sort picks
+            chosen = legal.argmax(axis=1)
+        else:
+            nth = (draws[playing, n_moves[playing]] * n_legal).astype(np.int64)
+            chosen = (legal.cumsum(axis=1) > nth[:, None]).argmax(axis=1)
+
+        from_waste = chosen < 16
+        to_found = chosen < 20
+        games = playing[from_waste]
+        heights[games, chosen[from_waste] // 4] -= 1
+        games = playing[to_found]
+        found_i = np.where(from_waste, chosen % 4, chosen - 16)[to_found]
+        found_lens[games, found_i] += 1
+        games = playing[~to_found]
+        waste_i = chosen[~to_found] - 20
+        wastes[games, waste_i, heights[games, waste_i]] = drawn[~to_found]
+        heights[games, waste_i] += 1
+        deck_lens[playing[~from_waste]] -= 1
+        n_moves[playing] += 1
+
+    return won, n_moves
+
 # Main Function
 
 def compare_players(player1, player2, cards_per_suit, num_games):
@@ -311,8 +624,17 @@ def compare_players(player1, player2, cards_per_suit, num_games):
   print("Player 1 won {0} games".format(results1.count(True)))
   print("Player 2 won {0} games".format(results2.count(True)))
 
-def main():
-    cards_per_suit = 7
+def main(argv):
+    parser = argparse.ArgumentParser(description="Compare the Calculation players and solvers")
+    parser.add_argument("cards_per_suit", type=int, nargs="?", default=7)
+    parser.add_argument("games", type=int, nargs="?", default=5,
+                        help="games each player plays")
+    parser.add_argument("--seed", type=int, help="seed for the decks and the random player")
+    args = parser.parse_args(argv[1:])
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    cards_per_suit = args.cards_per_suit
     board = CalculationBoard(cards_per_suit)
 
     print("===== STARTING DECK ======")
@@ -321,7 +643,7 @@ def main():
     print("===== COMPARING PLAYERS ========")
     player = RandomPlayer()
     player2 = GreedyPlayer()
-    compare_players(player, player2, cards_per_suit, 5)
+    compare_players(player, player2, cards_per_suit, args.games)
 
     print("===== BFS OLD PRIORITY ========")
     bfs = BFSSolver(board, old_priority)
@@ -336,6 +658,6 @@ def main():
     print("Num moves: {0}".format(len(end_board.moves)))
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv)
 
 
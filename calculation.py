@@ -1,13 +1,24 @@
 #!/usr/bin/env python
 from __future__ import division # for automatic floating point div
 import random                   # for shuffling
-from copy import deepcopy       # for static board states
-from queue import PriorityQueue # for keeping track of boards
 import sys                      # for main args
+import argparse                 # for command line options
 from math import inf            # for max threshold
 from time import time           # for performance
-import csv                      # for formatted output
-import os.path                  # for output files
+from collections import namedtuple # for batch results
+from functools import lru_cache # for sharing tables between games
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED # for batches
+import multiprocessing          # for sharing state with parallel IDA*
+import hashlib                  # for naming endgame files
+import os.path                  # for endgame files
+from search import TranspositionTable, zobrist_keys, mix64 # for duplicate boards
+from search import frontiers, SpillFrontier # for keeping track of boards
+from search import BudgetExceeded, SearchResult # for giving up on long searches
+from search import SearchStats  # for search statistics
+from search import EndgameTable # for solving small endgames once
+from results import ResultWriter # for output files
+from results import open_cache, code_digest # for not solving decks twice
+import json                     # for cache versions and weights
 
 """
 Calculation Player
@@ -40,35 +51,180 @@ Variables
         short_term  (favor piles that create chains)
 """
 
+class CardTables:
+    """
+    Everything about the foundations that only depends on cards_per_suit,
+    worked out once so that move generation only ever looks things up:
+        nth[f][n]            the card at position n of foundation f. Goes
+                             on (wrapping around) a few cards past the end,
+                             since buried_cost looks ahead of full ones.
+        next_card[f][n]      the card foundation f takes when it holds n
+                             cards, or None once it's full
+        positions[f][card]   every position card has in foundation f
+        needed[f][n][card]   the first of those positions at or past n, or
+                             None if foundation f doesn't need card any more
+        win_pos[card][f]     the first position of card in foundation f, or
+                             None if it never goes there (which happens when
+                             cards_per_suit isn't prime)
+        placed[f][n]         the cards in foundation f when it holds n
+        precedes[card][next] the foundations where next goes right on top
+                             of card (next == card + base)
+    """
+
+    def __init__(self, cards_per_suit):
+        values = list(range(1, cards_per_suit)) + [0]
+        bases = range(1, 5)
+        self.values = values
+        self.winning = [[(base*i) % cards_per_suit for i in values] for base in bases]
+        self.nth = [tuple((base + base*n) % cards_per_suit for n in range(cards_per_suit+5))
+                    for base in bases]
+        self.next_card = [tuple(win) + (None,) for win in self.winning]
+        self.positions = [[tuple(i for i, c in enumerate(win) if c == card)
+                           for card in range(cards_per_suit)] for win in self.winning]
+        self.needed = [[tuple(next((pos for pos in positions[card] if pos >= n), None)
+                              for card in range(cards_per_suit))
+                        for n in range(cards_per_suit+1)] for positions in self.positions]
+        self.win_pos = [[self.positions[f][card][0] if self.positions[f][card] else None
+                         for f in range(4)] for card in values]
+        self.placed = [[frozenset(win[:n]) for n in range(cards_per_suit+1)]
+                       for win in self.winning]
+        self.precedes = [[tuple(f for f, base in enumerate(bases) if card != 0 and after == card + base)
+                          for after in range(cards_per_suit)] for card in range(cards_per_suit)]
+
+@lru_cache(maxsize=None)
+def card_tables(cards_per_suit):
+    return CardTables(cards_per_suit)
+
+# How much each part of CalculationBoard.priority() counts (a, b, c and d
+# there). tuning.py fits these to solved games.
+Weights = namedtuple("Weights", ["distance", "difficulty", "evenness", "progress"],
+                     defaults=(1, 1, 1, 1))
+
+def load_weights(weights=None):
+    """
+    Weights from a Weights, a dict or sequence of the four, or the path of a
+    JSON file holding the dict. None gives the defaults.
+    """
+    if weights is None:
+        return Weights()
+    if isinstance(weights, str):
+        with open(weights) as f:
+            weights = json.load(f)
+    if isinstance(weights, dict):
+        return Weights(**weights)
+    return Weights(*weights)
+
 class CalculationBoard:
     """
     A CalculationBoard keeps track of the foundation piles and the waste piles.
-    These are kept track of in self.piles. Each board is specific to a game
-    of Calculation, but all boards of a game share a deck. Thus, each
-    CalculationBoard only keeps an index of where it is in the deck. 
+    Each board is specific to a game of Calculation, but all boards of a game
+    share a deck. Thus, each CalculationBoard only keeps an index of where it
+    is in the deck.
+
+    Boards are immutable and compact so that making a move is cheap. A
+    foundation is always a prefix of its winning sequence, so it is stored as
+    just its length (found_lens). The waste heaps are stored as a tuple of
+    tuples (wastes), and a child board only builds a new tuple for the one
+    pile that changed, sharing everything else with its parent. The board's
+    zobrist hash (zhash) is updated along with the move, so it never has to
+    be recomputed from the piles. It is built from a hash of the foundations
+    and deck (fd_hash) and one hash per waste heap (waste_hashes).
+    With symmetric on, waste heaps that hold the same cards in a different
+    order make the same board: they hash and compare equal, and the searches
+    skip moves that would only swap which heap is which. The k_pile is the
+    exception, because the kings strategy treats it differently.
     Each board also keeps track of its moves, which could at some point be
-    leveraged for data analysis/ML for smarter playing or for more efficient
-    storage of boards. Right now making a move makes a full copy of the board,
-    but it might be better to only copy the board every so often, and instead
-    have shells of boards that all go off a reference board, and then store 
-    the moves from that board.
+    leveraged for data analysis/ML for smarter playing. Moves are stored as
+    a chain of (move, previous history) pairs that children share with their
+    parent, so a board only costs one pair no matter how long the game is.
+    The full list is only rebuilt when something asks for board.moves.
+    A board's priority is worked out the first time something asks for it
+    (games on other heuristics never do) and kept in score. To keep that
+    cheap, card_pos records where every copy of each card sits in the waste
+    heaps, so buried_cost never has to search them.
     """
 
+    __slots__ = ('cards_per_suit', 'found_lens', 'wastes', 'last_used',
+                 'n_moves', 'history', 'kings_seen', 'zhash', 'fd_hash',
+                 'waste_hashes', 'card_pos', 'score', 'tables', 'weights',
+                 'symmetric')
+
     num_piles = 8
     deck_i = 8
     k_pile = 4 # Try keeping one waste pile open
 
-    def __init__(self, cards_per_suit=13):
+    def __init__(self, cards_per_suit=13, weights=Weights(), symmetric=True):
+        self.weights = weights  # for priority(), shared with every child
+        # Treat the (non-k_pile) waste heaps as interchangeable. Decided per
+        # game, since it changes how boards hash and compare.
+        self.symmetric = symmetric
+
         # Prepare the piles
-        foundations = [[i] for i in range(1,5)]
-        waste_heaps = [[] for i in range(4)]
-        self.piles = foundations + waste_heaps
+        self.found_lens = (1, 1, 1, 1)  # A, 2, 3, 4 start on the foundations
+        self.wastes = ((), (), (), ())
         self.last_used = 3 # Four foundations --> starts off with 
         self.cards_per_suit = cards_per_suit
+        self.tables = card_tables(cards_per_suit)
         self.n_moves = 0
-        self.moves = []
+        self.history = None
         self.kings_seen = 0
 
+        keys = zobrist_keys(cards_per_suit)
+        self.fd_hash = keys.deck[self.last_used]
+        for f in range(4):
+            self.fd_hash ^= keys.found[f][1]
+        self.waste_hashes = (0, 0, 0, 0)
+        self.zhash = self._combine(self.fd_hash, self.waste_hashes)
+
+        self.card_pos = ((),) * cards_per_suit # (waste, index) of each card
+        self.score = None   # see priority()
+
+    def _child(self, found_lens, wastes, last_used, kings_seen, move, fd_hash,
+               waste_hashes, card_pos):
+        """
+        Builds the board one move after this one without copying any piles
+        """
+        child = CalculationBoard.__new__(CalculationBoard)
+        child.cards_per_suit = self.cards_per_suit
+        child.tables = self.tables
+        child.weights = self.weights
+        child.symmetric = self.symmetric
+        child.found_lens = found_lens
+        child.wastes = wastes
+        child.last_used = last_used
+        child.n_moves = self.n_moves + 1
+        child.history = (move, self.history)
+        child.kings_seen = kings_seen
+        child.fd_hash = fd_hash
+        child.waste_hashes = waste_hashes
+        child.zhash = self._combine(fd_hash, waste_hashes)
+        child.card_pos = card_pos
+        child.score = None
+        return child
+
+    @property
+    def moves(self):
+        """
+        The list of moves from the start of the game to this board
+        """
+        moves = []
+        history = self.history
+        while history is not None:
+            move, history = history
+            moves.append(move)
+        moves.reverse()
+        return moves
+
+    @property
+    def piles(self):
+        """
+        The expanded list-of-lists view of the board (foundations, then
+        wastes). Only used for printing and comparisons, never in the search.
+        """
+        foundations = [[self.nth_card(base, n) for n in range(length)]
+                       for base, length in zip(range(1,5), self.found_lens)]
+        return foundations + [list(w) for w in self.wastes]
+
     def is_foundation(self, pile_i):
         return pile_i < 4
 
@@ -79,33 +235,26 @@ class CalculationBoard:
         """
         Only valid for foundations
         """
-        return (base + base*n) % self.cards_per_suit
+        return self.tables.nth[base-1][n]
 
     def next_card(self, pile_i):
         """
-        Only valid for foundations
+        Only valid for foundations. None once the foundation is full.
         """
-        pile = self.piles[pile_i]
-        return self.nth_card(pile[0], len(pile))
+        return self.tables.next_card[pile_i][self.found_lens[pile_i]]
 
-    def old_matches_next_card(self, pile_i):
-        foundation = self.piles[dest]
-        if len(foundation) >= self.cards_per_suit:
-            return False
-        else:
-            step = foundation[-1]
-            base = foundation[0]
-            return card == (step+base)%self.cards_per_suit
+    def in_foundation(self, card, pile_i):
+        """
+        Whether card has already been played on the foundation pile_i
+        """
+        return card in self.tables.placed[pile_i][self.found_lens[pile_i]]
 
     def valid_set(self, card, dest):
         # Always allowed to set on a waste pile
         if self.is_waste(dest):
             return True
         else:
-            return len(self.piles[dest])<self.cards_per_suit and card == self.next_card(dest) 
-
-        # If we didn't return True yet, it is not valid
-        return False
+            return card == self.tables.next_card[dest][self.found_lens[dest]]
 
     def valid_move(self, src, dest):
         """
@@ -116,78 +265,161 @@ class CalculationBoard:
         # Can't move to another waste pile
         valid_dest = self.is_foundation(dest)
         # Make sure the card is allowed for the move
-        valid_transition = self.valid_set(self.piles[src][-1], dest)
+        valid_transition = self.valid_set(self.wastes[src-4][-1], dest)
         
         return valid_source and valid_dest and valid_transition
 
+    def _waste_keys(self, waste_i):
+        """
+        The zobrist keys for cards on waste heap waste_i. With symmetric on,
+        every heap but the k_pile shares one set, so a heap's hash only
+        depends on what's in it.
+        """
+        keys = zobrist_keys(self.cards_per_suit).waste
+        if not self.symmetric:
+            return keys[waste_i]
+        return keys[0] if waste_i == CalculationBoard.k_pile-4 else keys[1]
+
+    def _combine(self, fd_hash, waste_hashes):
+        """
+        The board's hash from its foundation/deck hash and heap hashes. With
+        symmetric on, the interchangeable heaps are added up after mixing, so
+        their order doesn't matter and two equal heaps don't cancel out.
+        """
+        if not self.symmetric:
+            return fd_hash ^ waste_hashes[0] ^ waste_hashes[1] ^ waste_hashes[2] ^ waste_hashes[3]
+        total = 0
+        for waste_i, waste_hash in enumerate(waste_hashes):
+            if waste_i == CalculationBoard.k_pile-4:
+                fd_hash ^= waste_hash
+            else:
+                total += mix64(waste_hash)
+        return fd_hash ^ (total & 0xFFFFFFFFFFFFFFFF)
+
+    def is_symmetric_to_earlier(self, waste_i):
+        """
+        Whether an earlier waste heap holds exactly the same cards, so that
+        playing on or from this one would give a board we already have
+        """
+        if not self.symmetric or waste_i == CalculationBoard.k_pile-4:
+            return False
+        waste = self.wastes[waste_i]
+        return any(self.wastes[i] == waste for i in range(waste_i)
+                   if i != CalculationBoard.k_pile-4)
+
+    def canonical_wastes(self):
+        """
+        The waste heaps in an order that's the same for every board that
+        only differs by which heap is which
+        """
+        if not self.symmetric:
+            return self.wastes
+        k = CalculationBoard.k_pile-4
+        others = sorted(w for i, w in enumerate(self.wastes) if i != k)
+        if 0 <= k < 4:
+            return (self.wastes[k],) + tuple(others)
+        return tuple(others)
+
+    def _placed(self, card, dest, wastes, fd_hash, waste_hashes, card_pos):
+        """
+        Returns the (found_lens, wastes, fd_hash, waste_hashes, card_pos)
+        after putting card on dest
+        """
+        keys = zobrist_keys(self.cards_per_suit)
+        if self.is_foundation(dest):
+            found_lens = list(self.found_lens)
+            fd_hash ^= keys.found[dest][found_lens[dest]]
+            found_lens[dest] += 1
+            fd_hash ^= keys.found[dest][found_lens[dest]]
+            return tuple(found_lens), wastes, fd_hash, waste_hashes, card_pos
+        waste_i = dest-4
+        wastes = list(wastes)
+        depth = len(wastes[waste_i])
+        wastes[waste_i] += (card,)
+        waste_hash = waste_hashes[waste_i] ^ self._waste_keys(waste_i)[depth][card]
+        waste_hashes = waste_hashes[:waste_i] + (waste_hash,) + waste_hashes[waste_i+1:]
+        card_pos = card_pos[:card] + (card_pos[card] + ((waste_i, depth),),) + card_pos[card+1:]
+        return self.found_lens, tuple(wastes), fd_hash, waste_hashes, card_pos
+
     def play_drawn(self, card, dest):
         """
         Returns a new board with a card played from the deck onto a pile
         """
-        bcopy = deepcopy(self)
-        bcopy.piles[dest].append(card)
-        bcopy.last_used += 1
-        bcopy.n_moves += 1
-        bcopy.moves.append((CalculationBoard.deck_i, dest))
-        if card == 0:
-            bcopy.kings_seen += 1
-        return bcopy
+        keys = zobrist_keys(self.cards_per_suit)
+        fd_hash = self.fd_hash ^ keys.deck[self.last_used] ^ keys.deck[self.last_used+1]
+        found_lens, wastes, fd_hash, waste_hashes, card_pos = self._placed(
+            card, dest, self.wastes, fd_hash, self.waste_hashes, self.card_pos)
+        kings_seen = self.kings_seen + 1 if card == 0 else self.kings_seen
+        return self._child(found_lens, wastes, self.last_used + 1, kings_seen,
+                           (CalculationBoard.deck_i, dest), fd_hash, waste_hashes, card_pos)
 
     def move_card(self, src, dest):
         """
         Returns a new board with a card moved from src to dest
         """
-        bcopy = deepcopy(self)
-        card = bcopy.piles[src].pop()
-        bcopy.piles[dest].append(card)
-        bcopy.n_moves += 1
-        bcopy.moves.append((src, dest))
-        return bcopy
+        waste_i = src-4
+        wastes = list(self.wastes)
+        card = wastes[waste_i][-1]
+        wastes[waste_i] = wastes[waste_i][:-1]
+        depth = len(wastes[waste_i])
+        waste_hashes = self.waste_hashes
+        waste_hash = waste_hashes[waste_i] ^ self._waste_keys(waste_i)[depth][card]
+        waste_hashes = waste_hashes[:waste_i] + (waste_hash,) + waste_hashes[waste_i+1:]
+        card_pos = self.card_pos
+        card_pos = card_pos[:card] + (tuple(p for p in card_pos[card] if p != (waste_i, depth)),) + card_pos[card+1:]
+        found_lens, wastes, fd_hash, waste_hashes, card_pos = self._placed(
+            card, dest, tuple(wastes), self.fd_hash, waste_hashes, card_pos)
+        return self._child(found_lens, wastes, self.last_used, self.kings_seen,
+                           (src, dest), fd_hash, waste_hashes, card_pos)
 
     def len_priority(self):
         """
         priority = cost to board + board to finish
-                    (n_moves)       ()
+                    (n_moves)       (cards_to_go)
         """
-        deck_size = self.cards_per_suit*4
-        n_deck = deck_size - (self.last_used+1)
-        n_founds = sum(map(len, self.piles[:4]))
-        n_waste = sum(map(len, self.piles[4:]))
+        return self.n_moves + self.cards_to_go()
 
-        cost_to_board = self.n_moves
-        board_to_finish = n_deck + n_waste
-        return cost_to_board + board_to_finish
+    def cards_to_go(self):
+        """
+        Cards still in the deck or on the waste heaps
+        """
+        n_deck = self.cards_per_suit*4 - (self.last_used+1)
+        n_waste = sum(map(len, self.wastes))
+        return n_deck + n_waste
 
     def buried_cost(self):
         ans = 0
-        for found in self.piles[:4]:
-            base_card = found[0]
-            found_len = len(found)
-            next_card = self.nth_card(base_card, found_len)
+        nth = self.tables.nth
+        for base_card, found_len in zip(range(1,5), self.found_lens):
+            next_card = nth[base_card-1][found_len]
 
             for i in range(4):
                 # Hack to avoid going off the end
                 if next_card == base_card:
                     break
 
-                min_dist = None
-
-                for waste in self.piles[4:]:
-                    if next_card in waste:
-                        dist = len(waste) - waste.index(next_card)
-                        if min_dist != None:
-                            min_dist = min(min_dist, dist)
-                        else:
-                            min_dist = dist
-
+                # Each waste pile counts its deepest copy of the card
+                deepest = {}
+                for waste_i, index in self.card_pos[next_card]:
+                    dist = len(self.wastes[waste_i]) - index
+                    deepest[waste_i] = max(deepest.get(waste_i, 0), dist)
+                min_dist = min(deepest.values()) if deepest else None
 
                 if min_dist != None:
                     ans += min_dist * (self.cards_per_suit - found_len - i)
 
-                next_card = (next_card + base_card) % self.cards_per_suit
+                next_card = nth[base_card-1][found_len+i+1]
         return ans
 
     def priority(self):
+        """
+        The board's priority, computed the first time it's asked for
+        """
+        if self.score is None:
+            self.score = self._priority()
+        return self.score
+
+    def _priority(self):
         """
             Progress to goal: 
                 how many cards in foundation piles
@@ -195,9 +427,19 @@ class CalculationBoard:
                 how many cards are left in deck (at least)
             Difficulty: 
                 how buried are cards that are needed soon?
+        weighted by self.weights
+        """
+        distance, difficulty, evenness, progress = self.features()
+        a, b, c, d = self.weights
+        return distance*a + difficulty*b + evenness*c - progress*d
+
+    def features(self):
         """
-        found_sizes = [len(f) for f in self.piles[:4]]
-        waste_sizes = [len(w) for w in self.piles[4:]]
+        The (distance, difficulty, evenness, progress) that priority() is
+        made of
+        """
+        found_sizes = self.found_lens
+        waste_sizes = [len(w) for w in self.wastes]
 
         progress = sum(found_sizes)    # Num cards in foundations
         distance = (self.cards_per_suit*4) - (self.last_used+1)  # Num cards left in deck
@@ -208,22 +450,19 @@ class CalculationBoard:
 
         difficulty = self.buried_cost()  # How hard it is to get the next few
                                         # cards off the waste piles
-
-        a = 1
-        b = 1
-        c = 1
-        d = 1
-        return distance*a + difficulty*b + evenness*c - progress*d
+        return distance, difficulty, evenness, progress
 
     # Note this equality/less than disparity is terrible style
     def __lt__(self, other):
         return self.priority() < other.priority()
 
     def __eq__(self, other):
-        return str(self) == str(other)
+        return (self.zhash == other.zhash and self.last_used == other.last_used
+                and self.found_lens == other.found_lens
+                and self.canonical_wastes() == other.canonical_wastes())
 
     def __hash__(self):
-        return hash(str(self))
+        return self.zhash
 
     def __str__(self):
         string =  "Priority: {0!s}\n".format(self.priority())
@@ -244,6 +483,20 @@ class CalculationBoard:
     def __repr__(self):
         return str(self.piles)
 
+    def footprint(self):
+        """
+        Rough number of bytes the board takes up. Children share most of this
+        with their parent, so it's an overestimate, which is the safe side
+        for sizing things to fit in memory.
+        """
+        size = sys.getsizeof
+        n = size(self) + size(self.history) + size(self.score)
+        for ints in (self.found_lens, self.waste_hashes, self.zhash, self.fd_hash):
+            n += size(ints)
+        for nested in (self.wastes, self.card_pos):
+            n += size(nested) + sum(size(t) for t in nested)
+        return n
+
 class Calculation:
     """
     The Calculation class represents a game of Calculation. Each instance has
@@ -251,11 +504,20 @@ class Calculation:
     use the play_ida() for IDA* or play_bfs() for best-first search
     """
 
-    def __init__(self, cards_per_suit=13, deck=[]):
+    def __init__(self, cards_per_suit=13, deck=[], table_size=None, eviction="lru",
+                 frontier="heap", frontier_size=None, max_nodes=None,
+                 deadline=None, verbose=True, auto_play=False, heuristic="priority",
+                 stats=None, memory_limit=None, spill_dir=None, ranking="short_term",
+                 astar=False, endgame_cards=None, endgame_dir=None, cache=None,
+                 weights=None, optimal=False, h_weight=1, quick_solve=False,
+                 symmetric=True):
         self.cards_per_suit = cards_per_suit
-        self.values = list(range(1,cards_per_suit)) + [0]
-        self.winning = [[(base*i)%cards_per_suit for i in self.values] for base in range(1,5)]
-        self.win_pos = [[win_stack.index(i) for win_stack in self.winning] for i in self.values]
+        self.tables = card_tables(cards_per_suit)
+        self.values = self.tables.values
+        self.winning = self.tables.winning
+        self.win_pos = self.tables.win_pos
+        # Every index each card has in each winning stack
+        self.positions = self.tables.positions
 
         # Prepare the deck
         if deck == []:
@@ -263,102 +525,647 @@ class Calculation:
         else:
             self.deck = deck
 
-        self.played = set()     # Used to avoid redundant boards
+        # deck_left[i][card] = copies of card in self.deck[i:]
+        self.deck_left = [[0] * cards_per_suit]
+        for card in reversed(self.deck):
+            counts = list(self.deck_left[0])
+            counts[card] += 1
+            self.deck_left.insert(0, counts)
+
+        self.pruned = 0         # Boards ruled out by is_lost()
+        self.dropped = 0        # Boards a full frontier threw away
+        self.lost_at_start = False  # See lost_from_start()
+
+        # With optimal, play_bfs() is A* and play_ida() is IDA* on the
+        # admissible() heuristic, and both try every move, so the winning
+        # board they return has the fewest moves there can be. That rules
+        # out the settings that skip moves or shortcut the search. (A
+        # frontier_size that isn't spilled drops boards, which breaks the
+        # guarantee too.) An h_weight over 1 makes it weighted A*: faster,
+        # and never more than h_weight times the fewest moves.
+        self.optimal = optimal
+        if optimal:
+            heuristic = "admissible"
+            astar = True
+            ranking = "simple"
+            auto_play = False
+            endgame_cards = None
+        self.h_weight = h_weight
+
+        # Try quick_verdict() before searching, and skip the search if it
+        # settles the deck
+        self.quick_solve = quick_solve
+
+        # Follow every child with any moves that are safe to make right away
+        self.auto_play = auto_play
+
+        # Whether boards treat the waste heaps (but the k_pile) as
+        # interchangeable (see CalculationBoard)
+        self.symmetric = symmetric
+
+        # The weights of priority() (see load_weights())
+        self.weights = load_weights(weights)
+
+        # What the searches order boards by: one of Calculation.heuristics.
+        # With astar, the moves made so far are added on (to h_weight times
+        # the heuristic), so the heuristic should be an estimate of the moves
+        # left (like cards_to_go).
+        self.heuristic = heuristic
+        self.astar = astar
+        self.cost = Calculation.heuristics[heuristic]
+        if self.cost is Calculation.admissible:
+            self.cost = self.admissible     # it needs the deck
+        if astar:
+            heuristic_cost = self.cost
+            if h_weight == 1:
+                self.cost = lambda board: board.n_moves + heuristic_cost(board)
+            else:
+                self.cost = lambda board: board.n_moves + h_weight*heuristic_cost(board)
+
+        # How to order the waste heaps to play a drawn card on: one of
+        # Calculation.rankings (see the ranked_wastes_ methods)
+        if ranking not in Calculation.rankings:
+            raise ValueError("Unknown waste ranking: {}".format(ranking))
+        self.ranking = ranking
+        self.rank_wastes = getattr(self, "ranked_wastes_" + ranking)
         self.iters = 0          # Used for printing, maybe stats
+        self.verbose = verbose
+
+        # Give up once iters passes max_nodes or time() passes deadline
+        self.max_nodes = max_nodes
+        self.deadline = deadline
+        self.cancel = None      # Event that stops the search once it's set
+
+        # The board with the most cards on the foundations seen so far, so a
+        # search that runs out of budget still has something to show
+        self.best = None
+        self.best_progress = -1
 
         # IDA* thresholds
         self.threshold = inf
         self.next_threshold = inf  
 
-        # Store played boards to avoid cycles
-        self.played = set()
+        # With memory_limit (bytes), size the table and the in-memory part of
+        # the frontier to fit, and spill the rest of the frontier to disk
+        if memory_limit is not None:
+            table_size, frontier_size = self.memory_budget(memory_limit, table_size,
+                                                           frontier_size)
+            frontier = "spill"
+
+        # Store the fewest moves each played board was reached in, to avoid
+        # cycles and redundant boards. Bounded by table_size if given.
+        self.played = TranspositionTable(table_size, eviction)
+
+        # Best-first open list: "heap" or "bucket", capped at frontier_size,
+        # or "spill", which writes what doesn't fit to files in spill_dir
+        self.frontier = frontier
+        self.frontier_size = frontier_size
+        self.spill_dir = spill_dir
+
+        # Once a board has endgame_cards or fewer cards to go, it's solved
+        # exactly (see endgame()) and the answer kept in self.endgames, which
+        # is loaded from and saved to endgame_dir if given
+        self.endgame_cards = endgame_cards
+        self.endgame_dir = endgame_dir
+        if endgame_dir is not None:
+            self.endgames = EndgameTable.load(self.endgame_path(), self.deck)
+        else:
+            self.endgames = EndgameTable(self.deck)
+
+        # Optional SolveCache (or the path of one) that play_ida() and
+        # play_bfs() look in before searching and save what they find to.
+        # A hit sets iters to the nodes the original search expanded.
+        if isinstance(cache, str):
+            cache = open_cache(cache)
+        self.cache = cache
+        if cache is not None:
+            self.play_ida = self.cached("ida", self.play_ida)
+            self.play_bfs = self.cached("bfs", self.play_bfs)
+
+        # Optional SearchStats to report to. Only then are children(), the
+        # heuristic and the table lookups wrapped in timers. Boards work out
+        # their priority() lazily, on the first self.cost() call, so all of
+        # the heuristic's time lands under "priority" and none of it under
+        # "children".
+        self.stats = stats
+        if stats is not None:
+            self.cost = stats.timed("priority", self.cost)
+            self.children = stats.timed("children", self.children, tally="generated")
+            stats.watch_table(self.played)
+
+    # Rough bytes per entry, on top of the board itself
+    frontier_entry_bytes = 200
+    table_entry_bytes = 250
+
+    def memory_budget(self, memory_limit, table_size=None, frontier_size=None):
+        """
+        Splits memory_limit bytes between the transposition table and the
+        frontier. Returns (table_size, frontier_size), keeping either one
+        that was already given and handing its share to the other.
+        """
+        board_bytes = self.new_board().footprint() + Calculation.frontier_entry_bytes
+        if table_size is not None:
+            table_bytes = table_size * Calculation.table_entry_bytes
+        elif frontier_size is not None:
+            table_bytes = memory_limit - frontier_size * board_bytes
+        else:
+            table_bytes = memory_limit // 2
+        if table_size is None:
+            table_size = max(1, table_bytes // Calculation.table_entry_bytes)
+        if frontier_size is None:
+            frontier_size = max(2, (memory_limit - table_bytes) // board_bytes)
+        return table_size, frontier_size
+
+    def new_board(self):
+        """
+        The board at the start of the game
+        """
+        return CalculationBoard(self.cards_per_suit, self.weights, self.symmetric)
+
+    def options(self):
+        """
+        The settings that decide how this game is searched, as keyword
+        arguments for another Calculation (e.g. in a worker process)
+        """
+        return {"heuristic": self.heuristic, "auto_play": self.auto_play,
+                "ranking": self.ranking, "astar": self.astar,
+                "endgame_cards": self.endgame_cards, "weights": list(self.weights),
+                "optimal": self.optimal, "h_weight": self.h_weight,
+                "quick_solve": self.quick_solve, "symmetric": self.symmetric}
+
+    def cached(self, algorithm, search):
+        """
+        Wraps search so that it returns the cached solve for this deck if
+        there is one, and otherwise caches what it finds. Searches that run
+        out of budget aren't cached, and neither are ones that come back
+        empty handed without having searched_everything(), since that
+        doesn't mean the deck can't be won.
+        """
+        def cached_search():
+            key = self.cache_key(algorithm)
+            hit = self.cache.get(self.cards_per_suit, self.deck, key, solver_digest())
+            if hit is not None:
+                moves, self.iters, elapsed = hit
+                if moves is None:
+                    # Only proofs are cached, and with a ranking that skips
+                    # moves the proof was a lost first board
+                    self.lost_from_start(self.new_board())
+                    return None
+                return self.replay(moves)
+            start = time()
+            board = search()
+            if board is None and not self.searched_everything():
+                return board
+            self.cache.put(self.cards_per_suit, self.deck, key, solver_digest(),
+                           None if board is None else board.moves, self.iters, time()-start)
+            return board
+        return cached_search
+
+    def cache_key(self, algorithm):
+        """
+        What cached solves by algorithm are stored under: its name and every
+        setting that changes how it searches. The version they're stored
+        under is solver_digest().
+        """
+        settings = self.options()
+        if algorithm == "bfs":
+            settings.update(table_size=self.played.capacity, eviction=self.played.eviction,
+                            frontier=self.frontier, frontier_size=self.frontier_size)
+        return algorithm + " " + json.dumps(settings, sort_keys=True)
+
+    def replay(self, moves):
+        """
+        The board after making moves from the start of the game
+        """
+        board = self.new_board()
+        for move in moves:
+            board = self.make_move(board, move)
+        return board
+
+    def make_move(self, board, move):
+        """
+        The board after making move, a (src, dest) pair like board.moves has
+        """
+        src, dest = move
+        if src == CalculationBoard.deck_i:
+            return board.play_drawn(self.deck[board.last_used+1], dest)
+        return board.move_card(src, dest)
 
     @staticmethod
-    def random_deck(cards_per_suit):
+    def random_deck(cards_per_suit, rng=random):
         values = list(range(1, cards_per_suit)) + [0]
         all_values = (values * 4)
         non_foundation = all_values[4:]
-        random.shuffle(non_foundation)
+        rng.shuffle(non_foundation)
         return all_values[:4] + non_foundation
 
     def is_winning(self, board):
-        return board.piles[:4] == self.winning
+        return all(l == self.cards_per_suit for l in board.found_lens)
+
+    def cards_left(self, board):
+        """
+        Number of cards not yet on a foundation
+        """
+        return self.cards_per_suit*4 - sum(board.found_lens)
+
+    def admissible(self, board):
+        """
+        A lower bound on the moves left to win: every card still to go takes
+        at least one move, and a drawn card that can't go straight onto a
+        foundation (see forced_to_waste()) takes a second one to get off its
+        waste heap.
+        """
+        return board.cards_to_go() + self.forced_to_waste(board)
+
+    def forced_to_waste(self, board):
+        """
+        How many of the cards left in the deck can't possibly be played
+        straight from the deck. When a card is drawn, it can only go on a
+        foundation that needs it somewhere no further up than the foundation
+        could have been built by then, with the cards on the waste heaps and
+        the ones drawn before it. Foundations don't have to share those
+        cards here, which only makes the count smaller than it could be.
+        """
+        next_card = self.tables.next_card
+        needed = self.tables.needed
+        found_lens = board.found_lens
+        available = [len(pos) for pos in board.card_pos]
+        used = [[0] * self.cards_per_suit for f in range(4)]
+        reach = list(found_lens)
+        forced = 0
+        for card in self.deck[board.last_used+1:]:
+            playable = False
+            for f in range(4):
+                # Build foundation f as far as what's turned up allows
+                n = reach[f]
+                want = next_card[f][n]
+                while want is not None and used[f][want] < available[want]:
+                    used[f][want] += 1
+                    n += 1
+                    want = next_card[f][n]
+                reach[f] = n
+                pos = needed[f][found_lens[f]][card]
+                if pos is not None and pos <= n:
+                    playable = True
+            forced += not playable
+            available[card] += 1
+        return forced
+
+    def quick_verdict(self):
+        """
+        The cheap ways to settle a deck, tried before a search. Returns a
+        verdict and a board:
+            ("lost", None)    some card is needed more times than there are
+                              copies of it (is_lost() of the first board).
+                              That only happens when cards_per_suit isn't
+                              prime; otherwise every card has exactly as
+                              many copies as places that need it.
+            ("won", board)    one greedy game, always moving to the child
+                              with the best priority(), won; board is where
+                              it ended
+            (None, None)      the deck needs a search
+        Nothing here shows that a deck can't be won other than the first
+        check, so for prime cards_per_suit that still takes a search.
+
+        A greedy win isn't the shortest one, so optimal games skip the
+        greedy game.
+        """
+        board = self.new_board()
+        if self.lost_from_start(board):
+            return "lost", None
+        if not self.optimal:
+            board = self.play_policy(lambda children: min(children, key=CalculationBoard.priority))
+            if board is not None:
+                return "won", board
+        return None, None
+
+    def lost_from_start(self, board):
+        """
+        is_lost() for the first board of a search. A lost first board
+        proves the deck can't be won whatever the search skips, so it's
+        remembered in self.lost_at_start for solve().
+        """
+        self.lost_at_start = self.is_lost(board)
+        return self.lost_at_start
 
     def is_lost(self, board):
-        remaining_deck = self.deck[board.last_used+1:]
+        """
+        Whether board can no longer be won. Searches never expand lost boards,
+        so only what the last move changed has to be checked:
+            - a card played on a waste heap might be stuck on top of one of
+              the cards under it (see blocks())
+            - a card played on a foundation is one less copy of that card to
+              go around, and one less place the other copies can go
+        Counts how many boards it rules out in self.pruned.
+        """
+        if board.history is None:
+            lost = self.is_dead(board)
+        else:
+            lost = self.lost_by_last_move(board)
+        if lost:
+            self.pruned += 1
+            if self.stats is not None:
+                self.stats.pruned += 1
+        return lost
+
+    def lost_by_last_move(self, board):
+        """
+        The incremental part of is_lost(), without counting
+        """
+        src, dest = board.history[0]
+        if board.is_waste(dest):
+            waste_i = dest-4
+            return self.stuck(board, waste_i, len(board.wastes[waste_i])-1)
+        card = board.nth_card(dest+1, board.found_lens[dest]-1)
+        return any(self.stuck(board, waste_i, index, above=True)
+                   for waste_i, index in board.card_pos[card])
+
+    def is_dead(self, board):
+        """
+        The same check as is_lost(), but for every card on the board
+        """
+        # Some card is needed more times than there are copies left of it
+        for card in range(self.cards_per_suit):
+            needed = sum(self.needed_at(board, f, card) is not None for f in range(4))
+            if needed > self.copies_left(board, card):
+                return True
+        return any(self.stuck(board, waste_i, index)
+                   for waste_i, waste in enumerate(board.wastes)
+                   for index in range(len(waste)))
 
-        # TODO: Actually implement
-        # Loop through the waste piles and check if any have cards that block
-        # the card on all piles
-        return False
+    def needed_at(self, board, found_i, card):
+        """
+        The position card still has to go in foundation found_i, or None if
+        that foundation doesn't need it any more
+        """
+        return self.tables.needed[found_i][board.found_lens[found_i]][card]
+
+    def copies_left(self, board, card):
+        """
+        Copies of card that aren't on a foundation yet
+        """
+        return self.deck_left[board.last_used+1][card] + len(board.card_pos[card])
+
+    def stuck(self, board, waste_i, index, above=False):
+        """
+        Whether the card at wastes[waste_i][index] can never be played, either
+        because nothing needs it or because it blocks a card under it. With
+        above, also checks whether any card over it blocks it.
+        """
+        waste = board.wastes[waste_i]
+        card = waste[index]
+        if all(self.needed_at(board, f, card) is None for f in range(4)):
+            return True
+        if any(self.blocks(board, waste_i, index, below) for below in range(index)):
+            return True
+        return above and any(self.blocks(board, waste_i, over, index)
+                             for over in range(index+1, len(waste)))
+
+    def blocks(self, board, waste_i, over, under):
+        """
+        Whether the card at wastes[waste_i][over] can never leave because of
+        the card under it. That happens when every foundation that still
+        needs it needs the lower card first, and every other copy of the
+        lower card is buried under it too, so no copy can go first.
+        """
+        waste = board.wastes[waste_i]
+        card = waste[over]
+        lower = waste[under]
+        for f in range(4):
+            card_pos = self.needed_at(board, f, card)
+            if card_pos is None:
+                continue
+            lower_pos = self.needed_at(board, f, lower)
+            if lower_pos is None or lower_pos > card_pos:
+                return False
+        buried = sum(1 for i in range(over) if waste[i] == lower)
+        return self.copies_left(board, lower) == buried
 
     def play_bfs(self):
         """
         Best-first Search, based on priority() as defined in CalculationBoard.
-        Returns the number of moves required to get to the winning board.
+        Returns the winning board, or None if every board has been tried.
         """
-        boards = PriorityQueue()
-        new_board = CalculationBoard(self.cards_per_suit)
-        boards.put(new_board)
+        # Entries carry the board's cached priority, and ties go to whichever
+        # board was pushed first, so the heap never has to compare boards
+        if self.frontier == "spill":
+            boards = SpillFrontier(self.frontier_size, self.spill_dir)
+        else:
+            boards = frontiers[self.frontier](self.frontier_size)
+        new_board = self.new_board()
+        if self.lost_from_start(new_board):
+            return None
+        boards.push(new_board, self.cost(new_board), new_board)
         
         while boards:
-            board = boards.get()
-            self.played.add(board)
+            _, board = boards.pop()
+            if self.played.seen(board.zhash, board.n_moves):
+                continue
+            self.played.put(board.zhash, board.n_moves, self.cards_left(board))
 
-            self.print_board(board)
+            self.visit(board)
 
             if self.is_winning(board):
                 return board
 
             children = self.children(board)
             for child in children:
-                if child not in self.played:
-                    boards.put(child)
+                if self.is_lost(child):
+                    continue
+                if self.in_endgame(child):
+                    winner = self.finish_endgame(child)
+                    if winner is not None:
+                        return winner
+                    continue
+                if not self.played.seen(child.zhash, child.n_moves):
+                    boards.push(child, self.cost(child), child)
+        self.dropped += boards.pruned
+        return None
 
     def play_ida(self):
         """
         Iterative deepening algorithm to save on space
         """
         # Initial setup
-        root = CalculationBoard(self.cards_per_suit)
-        self.threshold = root.priority()
+        root = self.new_board()
+        self.threshold = self.cost(root)
         self.next_threshold = inf
         self.iters += 1
+        if self.lost_from_start(root):
+            return None
 
         # Start the search
         not_winning = True
         best_board = None
         while not_winning:
-            print("IDA start")
+            if self.verbose:
+                print("IDA start")
+            if self.stats is not None:
+                self.stats.iteration(self.threshold)
             not_winning, best_board = self.dfs(root)
+            # Nothing was pruned, so the whole tree has been searched
+            if not_winning and self.next_threshold == inf:
+                return None
             self.threshold = self.next_threshold
             self.next_threshold = inf
         return best_board
 
-    def dfs(self, board):
-        self.print_board(board)
-    
-        # Children = boards one move away from this board
-        children = self.children(board)
-        children.sort()
+    def play_parallel_ida(self, workers=None, split_depth=2):
+        """
+        IDA* with the search tree split between worker processes. Every
+        iteration, the boards split_depth moves below the root that are under
+        the threshold are handed out one at a time to whichever worker is
+        free, so workers that finish small subtrees pick up more work. The
+        workers share the smallest cost they pruned (the next threshold) and
+        an event that stops all of them as soon as one finds a winner.
+        Returns the winning board, or None if the deck can't be won.
+
+        The workers also share a count of the boards expanded so far, so
+        max_nodes holds for all of them together (give or take the boards
+        a worker expands between updates, see _share_nodes()).
+        """
+        root = self.new_board()
+        self.threshold = self.cost(root)
+        self.iters += 1
+        if self.lost_from_start(root):
+            return None
+
+        next_threshold = multiprocessing.Value('d', inf)
+        cancel = multiprocessing.Event()
+        nodes = multiprocessing.Value('q', 0)
+        with ProcessPoolExecutor(workers, initializer=_init_ida_worker,
+                                 initargs=(self.cards_per_suit, self.deck, next_threshold,
+                                           cancel, self.deadline, self.options(),
+                                           self.stats is not None, nodes,
+                                           self.max_nodes)) as pool:
+            while True:
+                if self.verbose:
+                    print("IDA start")
+                if self.stats is not None:
+                    self.stats.iteration(self.threshold)
+                self.next_threshold = inf
+                winner, boards = self.split(root, split_depth)
+                if winner is not None:
+                    return winner
+
+                next_threshold.value = self.next_threshold
+                nodes.value = self.iters
+                cancel.clear()
+                futures = [pool.submit(_ida_subtree, board, self.threshold) for board in boards]
+                for future in as_completed(futures):
+                    winner, iters, counts, exceeded = future.result()
+                    self.iters += iters
+                    if counts is not None:
+                        self.stats.merge(counts)
+                    if exceeded is not None:
+                        # Out of nodes or time: stop everyone else too
+                        cancel.set()
+                        for f in futures:
+                            f.cancel()
+                        raise BudgetExceeded(exceeded)
+                    if winner is not None:
+                        cancel.set()
+                        for f in futures:
+                            f.cancel()
+                        if self.verbose:
+                            print("Found winner")
+                        return winner
+
+                # Nothing was pruned, so the whole tree has been searched
+                if next_threshold.value == inf:
+                    return None
+                self.threshold = next_threshold.value
+
+    def split(self, board, depth):
+        """
+        Walks the tree like dfs() does, but stops depth moves below board.
+        Returns (winner, boards): a winning board if one turned up on the way,
+        and the boards at that depth that would be expanded.
+        """
+        if depth == 0:
+            return None, [board]
+        self.visit(board)
 
+        boards = []
+        children = self.children(board)
+        children.sort(key=self.cost)
         for child in children:
-            # If it is winning, return that board
             if self.is_winning(child):
-                print("Found winner")
+                return child, []
+            if self.is_lost(child):
+                continue
+            if self.in_endgame(child):
+                winner = self.finish_endgame(child)
+                if winner is not None:
+                    return winner, []
+                continue
+            cost = self.cost(child)
+            if cost <= self.threshold:
+                winner, below = self.split(child, depth-1)
+                if winner is not None:
+                    return winner, []
+                boards.extend(below)
+            elif cost < self.next_threshold:
+                self.next_threshold = cost
+        return None, boards
+
+    def dfs(self, board):
+        """
+        One IDA* iteration below board: expands every board whose cost is
+        within the threshold, cheapest children first, and keeps the
+        smallest cost over it in next_threshold. Returns (True, None), or
+        (False, winner) as soon as a winning board turns up.
+
+        The path is kept on an explicit stack of child iterators instead of
+        recursing, so deep games can't hit the recursion limit. Boards are
+        immutable and share everything but the pile a move changed, so
+        going back up the stack is just dropping the iterator; nothing has
+        to be undone or copied.
+        """
+        # Looked up once, since this loop runs for every board
+        children_of = self.children
+        cost_of = self.cost
+        is_winning = self.is_winning
+        is_lost = self.is_lost
+        visit = self.visit
+        threshold = self.threshold
+
+        def ordered_children(board):
+            # Children = boards one move away from this board
+            children = children_of(board)
+            children.sort(key=cost_of)
+            return iter(children)
+
+        visit(board)
+        stack = [ordered_children(board)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                continue
+
+            # If it is winning, return that board
+            if is_winning(child):
+                if self.verbose:
+                    print("Found winner")
                 return (False, child)
 
-            # If the child has already lost, quit early
-            if self.is_lost(child):
-                break
+            # If the child has already lost, don't bother with it
+            if is_lost(child):
+                continue
+
+            # Small enough to solve outright
+            if self.in_endgame(child):
+                winner = self.finish_endgame(child)
+                if winner is not None:
+                    return (False, winner)
+                continue
 
             # If the child is worth expanding, do so
-            cost = child.priority()
-            if cost <= self.threshold:
-                not_winning, winner = self.dfs(child)
-                # Break out if child succeeded
-                if not not_winning:
-                    return not_winning, winner
+            cost = cost_of(child)
+            if cost <= threshold:
+                visit(child)
+                stack.append(ordered_children(child))
 
             # If the child is not worth expanding, then it can at least
             # bound our future generations
@@ -367,13 +1174,230 @@ class Calculation:
 
         return (True, None)
 
+    def play_greedy(self):
+        """
+        Plays one game without backtracking, always making the move to the
+        child with the lowest cost. Returns the winning board, or None if it
+        got stuck.
+        """
+        return self.play_policy(lambda children: min(children, key=self.cost))
+
+    def play_random(self, rng=random):
+        """
+        Plays one game without backtracking, making a random move each time
+        """
+        return self.play_policy(rng.choice)
+
+    def play_policy(self, choose):
+        """
+        Plays one game, letting choose pick which of the children (that
+        aren't lost) to move to each turn. Returns the winning board, or None
+        if there was nothing left to choose.
+        """
+        board = self.new_board()
+        if self.lost_from_start(board):
+            return None
+        board = self.playout(board, choose)
+        return board if self.is_winning(board) else None
+
+    def playout(self, board, choose):
+        """
+        Plays on from board the way play_policy() does, and returns the
+        board it ends on, whether it won or got stuck
+        """
+        while not self.is_winning(board):
+            self.visit(board)
+            children = [child for child in self.children(board) if not self.is_lost(child)]
+            if not children:
+                break
+            board = choose(children)
+        return board
+
+    def play_monte_carlo(self, level=1, rollouts=1000, epsilon=0.1, rng=random):
+        """
+        Nested Monte Carlo search. A level 0 search is a single rollout: a
+        quick game that makes the first move children() offers (foundation
+        moves, then the waste heaps in ranking order), or a random one
+        epsilon of the time. A level n search plays a game move by move,
+        running a level n-1 search under every child and then making the
+        move toward the best game any of them found, the one that got the
+        most cards onto the foundations.
+
+        The search starts over until a game is won or rollouts rollouts
+        have been played. The best board any rollout reached is kept in
+        self.best, so a search stopped by its budget still has its best
+        line. Returns the winning board, or None.
+        """
+        self.rollouts = 0
+        root = self.new_board()
+        if self.lost_from_start(root):
+            return None
+
+        def policy(children):
+            if rng.random() < epsilon:
+                return rng.choice(children)
+            return children[0]
+
+        while self.rollouts < rollouts:
+            end = self.nested(root, level, policy, rollouts)
+            if self.is_winning(end):
+                if self.verbose:
+                    print("Found winner")
+                return end
+        return None
+
+    def nested(self, board, level, policy, rollouts):
+        """
+        One level-level search from board (see play_monte_carlo()). Returns
+        the best board it reached.
+        """
+        if level == 0:
+            end = self.playout(board, policy)
+            self.rollouts += 1
+            self.keep_best(end)
+            return end
+
+        best = None
+        while not self.is_winning(board):
+            children = [child for child in self.children(board) if not self.is_lost(child)]
+            if not children:
+                break
+            for child in children:
+                end = self.nested(child, level-1, policy, rollouts)
+                if best is None or sum(end.found_lens) > sum(best.found_lens):
+                    best = end
+                if self.is_winning(best) or self.rollouts >= rollouts:
+                    return best
+            # Follow the best game found so far one move further
+            board = self.make_move(board, best.moves[board.n_moves])
+        return board if best is None else best
+
+    def in_endgame(self, board):
+        """
+        Whether board is small enough for endgame()
+        """
+        return self.endgame_cards is not None and board.cards_to_go() <= self.endgame_cards
+
+    def endgame_key(self, board):
+        """
+        What endgames are stored under. The deck is fixed, so last_used
+        stands for what's left of it.
+        """
+        return (board.last_used, board.found_lens, board.canonical_wastes())
+
+    def endgame(self, board):
+        """
+        The fewest moves it takes to win from board, or None if it can't be
+        won, found by trying every move (not just the ones the ranking
+        likes) and remembered in self.endgames. Every board on the way is
+        smaller than board, so this is only quick for small boards.
+
+        Every card to go takes at least one more move, so cards_to_go() is
+        a lower bound: children that can't beat the best so far are skipped,
+        and the search stops as soon as it finds a way that meets the bound.
+        """
+        key = self.endgame_key(board)
+        if key in self.endgames:
+            return self.endgames.get(key)
+        if self.is_winning(board):
+            fewest = 0
+        else:
+            self.visit(board)
+            fewest = None
+            least = board.cards_to_go()
+            for child in self.next_boards(board, self.ranked_wastes_simple):
+                if fewest is not None and child.cards_to_go()+1 >= fewest:
+                    continue
+                if self.lost_by_last_move(child):
+                    continue
+                moves = self.endgame(child)
+                if moves is not None and (fewest is None or moves+1 < fewest):
+                    fewest = moves+1
+                    if fewest == least:
+                        break
+        self.endgames.put(key, fewest)
+        return fewest
+
+    def finish_endgame(self, board):
+        """
+        The winning board at the end of the shortest way to win from board,
+        or None if it can't be won
+        """
+        moves = self.endgame(board)
+        if moves is None:
+            return None
+        while moves:
+            moves -= 1
+            board = next(child for child in self.next_boards(board, self.ranked_wastes_simple)
+                         if not self.lost_by_last_move(child) and self.endgame(child) == moves)
+        return board
+
+    def endgame_path(self):
+        """
+        Where the endgames of this deck are saved in endgame_dir
+        """
+        digest = hashlib.sha1(bytes(self.deck)).hexdigest()[:16]
+        return os.path.join(self.endgame_dir, "endgames-{0!s}-{1}.pickle".format(
+            self.cards_per_suit, digest))
+
+    def save_endgames(self):
+        if self.endgame_dir is not None:
+            os.makedirs(self.endgame_dir, exist_ok=True)
+            self.endgames.save(self.endgame_path())
+
+    def is_safe(self, board, card, found_i):
+        """
+        Whether playing card on foundation found_i is never a mistake: it
+        fits there and no other foundation needs it, so it has to end up
+        there anyway, and playing it now only unblocks things sooner
+        """
+        return (board.valid_set(card, found_i) and
+                all(self.needed_at(board, f, card) is None for f in range(4) if f != found_i))
+
+    def play_safe_moves(self, board):
+        """
+        Makes safe moves (see is_safe()) from the waste heaps and the deck
+        until there are none left. All the moves are recorded as usual, so
+        the result is one macro move that still shows every step.
+        """
+        # is_lost() only looks at the last move, so stop on the first move
+        # that loses, before a safe move on top of it hides the loss
+        while not self.lost_by_last_move(board):
+            for waste_i in range(4,8):
+                waste = board.wastes[waste_i-4]
+                found_i = next((f for f in range(4) if waste and self.is_safe(board, waste[-1], f)), None)
+                if found_i is not None:
+                    board = board.move_card(waste_i, found_i)
+                    break
+            else:
+                if board.last_used >= len(self.deck)-1:
+                    return board
+                card = self.deck[board.last_used+1]
+                found_i = next((f for f in range(4) if self.is_safe(board, card, f)), None)
+                if found_i is None:
+                    return board
+                board = board.play_drawn(card, found_i)
+        return board
+
     def children(self, board):
+        if self.auto_play:
+            return [self.play_safe_moves(child) for child in self.next_boards(board)]
+        return self.next_boards(board)
+
+    def next_boards(self, board, rank_wastes=None):
+        """
+        Every board one move away from board (that's worth trying). Cards
+        drawn for the waste heaps go where rank_wastes (self.rank_wastes by
+        default) puts them.
+        """
+        if rank_wastes is None:
+            rank_wastes = self.rank_wastes
         children = []
 
         # Check if anything is playable from the waste heaps
         for waste_i in range(4,8):
-            waste_heap = board.piles[waste_i]
-            if len(waste_heap) > 0:
+            waste_heap = board.wastes[waste_i-4]
+            if len(waste_heap) > 0 and not board.is_symmetric_to_earlier(waste_i-4):
                 for found_i in range(4):
                     if board.valid_move(waste_i, found_i):
                         next_board = board.move_card(waste_i, found_i)
@@ -390,7 +1414,7 @@ class Calculation:
                     children.append(next_board)
 
             # Place on waste piles in order
-            waste_moves = self.ranked_wastes_short_term(next_card, board)
+            waste_moves = rank_wastes(next_card, board)
             children.extend(waste_moves)
 
         return children
@@ -399,32 +1423,29 @@ class Calculation:
     # a decent proxy for how much you're actually going to be blocking by
     # playing on that pile
     def ranked_wastes_simple(self, card, board):
-        waste_lens = [(len(board.piles[i]),i) for i in range(4,8)]
+        waste_lens = [(len(board.wastes[i-4]),i) for i in range(4,8)
+                      if not board.is_symmetric_to_earlier(i-4)]
         waste_lens.sort()
         return [board.play_drawn(card, w) for (l,w) in waste_lens]
 
     def precedes(self, board, card, next_card):
-        # K precedes nothing
-        if card == 0:
-            return False
-
-        # Check if it will eventually follow it on any foundation
-        for i in range(4):
-            base = board.piles[i][0]
-            # If it follows the card and the card has not already been placed
-            if next_card == card + base and card not in board.piles[i]:
-                return True
-        return False
+        # K precedes nothing, which the table already knows.
+        # If it follows the card on some foundation and the card has not
+        # already been placed there
+        return any(not board.in_foundation(card, i)
+                   for i in self.tables.precedes[card][next_card])
 
     def ranked_wastes_short_term(self, card, board):
         waste_moves = []
         for waste_i in range(4,8):
+            if board.is_symmetric_to_earlier(waste_i-4):
+                continue
             next_board = board.play_drawn(card, waste_i)
-            if next_board not in self.played:
+            if not self.played.seen(next_board.zhash, next_board.n_moves):
                 is_k_pile = (waste_i == CalculationBoard.k_pile)
-                waste_pile = board.piles[waste_i]
+                waste_pile = board.wastes[waste_i-4]
                 # If card precedes a card in some waste pile, play it there first
-                if len(waste_pile)>0 and self.precedes(board, card, board.piles[waste_i][-1]):
+                if len(waste_pile)>0 and self.precedes(board, card, waste_pile[-1]):
                     waste_moves.insert(0, next_board)
                 # If it's the king pile, only play kings unless all kings have
                 # been seen
@@ -442,6 +1463,8 @@ class Calculation:
         # Place on waste piles in order
         waste_moves = []
         for waste_i in range(4,8):
+            if board.is_symmetric_to_earlier(waste_i-4):
+                continue
             # Try only playing kings on K pile
             k_pile_playable = (card == 0 or board.kings_seen == 4)
             if waste_i == CalculationBoard.k_pile:
@@ -454,100 +1477,438 @@ class Calculation:
 
         return waste_moves
 
+    def solve(self, algorithm="ida", timeout=None, max_nodes=None, rng=random, **kwargs):
+        """
+        Runs algorithm (one of algorithms) and returns a SearchResult,
+        whether it finishes or runs out of budget. A search that comes back
+        without a win is "unsolvable" only if its first board was already
+        lost or it searched_everything(), and "exhausted" otherwise. timeout (seconds from
+        now) and max_nodes tighten the deadline and node budget the game
+        was made with. rng is for the random and Monte Carlo players, and
+        kwargs go to the play_ method (e.g. rollouts for monte_carlo).
+        "astar" needs a game made with astar=True. With quick_solve, decks
+        quick_verdict() settles aren't searched at all.
+
+        Every call starts from scratch (see reset()), and the tightened
+        budget only lasts for the call, so a game can be solved again, e.g.
+        with a bigger budget.
+        """
+        if algorithm not in algorithms:
+            raise ValueError("Unknown algorithm: {}".format(algorithm))
+        if algorithm == "astar" and not self.astar:
+            raise ValueError("astar needs Calculation(astar=True)")
+        self.reset()
+        start = time()
+        game_deadline, game_max_nodes = self.deadline, self.max_nodes
+        if timeout is not None:
+            deadline = start + timeout
+            self.deadline = deadline if self.deadline is None else min(self.deadline, deadline)
+        if max_nodes is not None:
+            self.max_nodes = max_nodes if self.max_nodes is None else min(self.max_nodes, max_nodes)
+
+        play = {"ida": self.play_ida, "parallel_ida": self.play_parallel_ida,
+                "bfs": self.play_bfs, "astar": self.play_bfs,
+                "greedy": self.play_greedy, "random": self.play_random,
+                "monte_carlo": self.play_monte_carlo}[algorithm]
+        if algorithm in ("random", "monte_carlo"):
+            kwargs["rng"] = rng
+
+        board = None
+        verdict = None
+        try:
+            if self.quick_solve:
+                verdict, board = self.quick_verdict()
+            if verdict is None:
+                board = play(**kwargs)
+        except BudgetExceeded as e:
+            status = e.args[0]
+        else:
+            if board is not None:
+                status = "solved"
+            elif self.lost_at_start:
+                status = "unsolvable"
+            elif algorithm in ("greedy", "random", "monte_carlo"):
+                status = "unsolved"
+            elif self.searched_everything():
+                status = "unsolvable"
+            else:
+                status = "exhausted"
+        finally:
+            self.deadline, self.max_nodes = game_deadline, game_max_nodes
+        return SearchResult(status, board, self.best if board is None else board, self.iters,
+                            time()-start, None if self.stats is None else self.stats.counts())
+
+    def searched_everything(self):
+        """
+        Whether a search that came back without a win tried every move, so
+        the deck really can't be won. Only the simple ranking plays a drawn
+        card on every waste heap (the others keep the k_pile for kings), and
+        a frontier_size that isn't spilled throws boards away. A search
+        whose first board was lost had nothing to try.
+        """
+        return self.lost_at_start or (self.ranking == "simple" and self.dropped == 0)
+
+    def reset(self):
+        """
+        Forgets what the last search left behind: the boards it played, its
+        counts (stats included), its best board and its IDA* thresholds.
+        Endgames are kept, since they're exact whatever searched them.
+        """
+        self.played = TranspositionTable(self.played.capacity, self.played.eviction)
+        if self.stats is not None:
+            self.stats.reset()
+            self.stats.watch_table(self.played)
+        self.iters = 0
+        self.pruned = 0
+        self.dropped = 0
+        self.lost_at_start = False
+        self.rollouts = 0
+        self.best = None
+        self.best_progress = -1
+        self.threshold = inf
+        self.next_threshold = inf
+
+    def keep_best(self, board):
+        """
+        Keeps board as self.best if it has more cards on the foundations
+        """
+        progress = sum(board.found_lens)
+        if progress > self.best_progress:
+            self.best = board
+            self.best_progress = progress
+
+    def visit(self, board):
+        """
+        Called for every board a search expands. Keeps count, keeps the best
+        board, checks the search's budget and prints the board every so
+        often.
+        """
+        self.iters += 1
+        self.keep_best(board)
+        if self.stats is not None:
+            self.stats.expand()
+        if self.max_nodes is not None and self.iters > self.max_nodes:
+            raise BudgetExceeded("nodes")
+        # Checking the clock is slower than the rest of this, so only
+        # do it every so often
+        if self.iters % 256 == 0:
+            if self.deadline is not None and time() > self.deadline:
+                raise BudgetExceeded("timeout")
+            if self.cancel is not None and self.cancel.is_set():
+                raise BudgetExceeded("cancelled")
+        self.print_board(board)
+
     def print_board(self, board):
         """
         Function for printing the board every so often, usually only used 
         for larger/longer games
         """
-        self.iters += 1
-        if self.iters % 10000 == 0:
+        if self.verbose and self.iters % 10000 == 0:
             print("=== Current board ===")
             print(board)
         return
 
-# Output Printing Functions
+Calculation.heuristics = {
+    "priority": CalculationBoard.priority,
+    "len_priority": CalculationBoard.len_priority,
+    "cards_to_go": CalculationBoard.cards_to_go,
+    "admissible": Calculation.admissible,
+}
+
+# Every ranked_wastes_ method
+Calculation.rankings = ("simple", "short_term", "k")
 
-def human_readable(niters, decks, moves, times, cards_per_suit, mode):
+@lru_cache(maxsize=None)
+def solver_digest():
     """
-    Could replace the csv output if you want to be able to just look at the 
-    output, rather than have another program analyze it. Kept in a separate
-    function in case I ever want to use it again 
+    code_digest() of everything the boards and searches do, so cached solves
+    are thrown out whenever the heuristics or the search change
     """
-    version = 0
-    filebase = "output/priority-{0!s}-{1}-sorted-{2!s}".format(cards_per_suit, mode, version)
-    filename = filebase + ".txt"
-    while os.path.exists(filename):
-        version += 1
-        filebase = filebase[:-1] + str(version)
-        filename = filebase + ".txt"
-    print("Writing to", filename)
-    with open(filename, 'w+') as output:
-        output.write("Cards per Suit: "+str(cards_per_suit)+"\n")
-        output.write("=================\n")
-        for i in range(niters):
-            deck = decks[i]
-            move = moves[i]
-            elapsed = times[i]
-            output.write("Deck:"+str(deck)+"\n")
-            output.write("Moves:"+str(move)+"\n")
-            output.write("Time elapsed:"+str(elapsed)+"\n")
-
-def program_readable(niters, decks, moves, times, cards_per_suit, mode):
-    version = 0
-    csvbase = "data/priority1-{0!s}-{1}-{2!s}".format(cards_per_suit, mode, version)
-    csvname = csvbase + ".txt"
-    while os.path.exists(csvname):
-        version += 1
-        csvbase = csvbase[:-1] + str(version)
-        csvname = csvbase + ".csv"
-    with open(csv_name, 'w+') as csvfile:
-        writer = csv.writer(csvfile)
-        for i in range(niters):
-            writer.writerow([decks[i], moves[i], times[i]])
-
-# Main Function
+    funcs = []
+    for cls in (CalculationBoard, Calculation, CardTables):
+        for attr in vars(cls).values():
+            if isinstance(attr, property):
+                attr = attr.fget
+            if isinstance(attr, staticmethod):
+                attr = attr.__func__
+            if hasattr(attr, "__code__"):
+                funcs.append(attr)
+    return code_digest(*funcs)
+
+# Parallel IDA* workers
+
+_ida_worker = {}
+
+def _init_ida_worker(cards_per_suit, deck, next_threshold, cancel, deadline,
+                     options, keep_stats, nodes, max_nodes):
+    """
+    Runs once in each worker process, to hold on to the game and shared state
+    """
+    _ida_worker["game"] = (cards_per_suit, deck, deadline, options)
+    _ida_worker["keep_stats"] = keep_stats
+    _ida_worker["next_threshold"] = next_threshold
+    _ida_worker["cancel"] = cancel
+    _ida_worker["nodes"] = nodes
+    _ida_worker["max_nodes"] = max_nodes
+
+def _share_nodes(calculation, nodes, max_nodes, every=64):
+    """
+    Wraps calculation.visit so that every few boards, what the worker has
+    expanded is added to nodes (shared by every worker and the parent), and
+    the search stops once they've expanded more than max_nodes between
+    them. Returns a function that adds whatever is left over when the
+    worker is done.
+    """
+    visit = calculation.visit
+    shared = [0]      # how much of calculation.iters is already in nodes
+    def share():
+        with nodes.get_lock():
+            nodes.value += calculation.iters - shared[0]
+            total = nodes.value
+        shared[0] = calculation.iters
+        return total
+    def shared_visit(board):
+        visit(board)
+        if calculation.iters - shared[0] >= every and share() > max_nodes:
+            raise BudgetExceeded("nodes")
+    calculation.visit = shared_visit
+    return share
+
+def _ida_subtree(board, threshold):
+    """
+    Runs one IDA* iteration on the subtree under board. Returns the winning
+    board (or None), the number of boards expanded, the SearchStats counts
+    for the subtree if the parent is keeping stats, and the reason the
+    worker ran out of budget ("nodes" or "timeout"), if it did.
+    """
+    cards_per_suit, deck, deadline, options = _ida_worker["game"]
+    stats = SearchStats() if _ida_worker["keep_stats"] else None
+    max_nodes = _ida_worker["max_nodes"]
+    calculation = Calculation(cards_per_suit, deck, deadline=deadline, max_nodes=max_nodes,
+                              verbose=False, stats=stats, **options)
+    calculation.cancel = _ida_worker["cancel"]
+    if calculation.cancel.is_set():
+        return None, 0, None, None
+    if max_nodes is not None:
+        share = _share_nodes(calculation, _ida_worker["nodes"], max_nodes)
+    calculation.threshold = threshold
+    calculation.next_threshold = inf
+
+    winner = exceeded = None
+    try:
+        not_winning, winner = calculation.dfs(board)
+    except BudgetExceeded as e:
+        # Another worker won (or ran out) already
+        if e.args[0] != "cancelled":
+            exceeded = e.args[0]
+    else:
+        shared = _ida_worker["next_threshold"]
+        with shared.get_lock():
+            shared.value = min(shared.value, calculation.next_threshold)
+    if max_nodes is not None:
+        share()
+    return winner, calculation.iters, None if stats is None else stats.counts(), exceeded
+
+# Batch Solving
+
+SolveResult = namedtuple("SolveResult",
+                         ["index", "deck", "status", "moves", "nodes", "elapsed"])
+
+def seeded_decks(cards_per_suit, seeds):
+    """
+    One deck per seed, the same every time for the same seed
+    """
+    return [Calculation.random_deck(cards_per_suit, random.Random(seed)) for seed in seeds]
 
-def main(argv):
-    cards_per_suit = 5
-    niters = 1
-    mode = "ida"
+def read_decks(path):
+    """
+    Reads decks from a file with one deck per line, either as a JSON list
+    or as numbers separated by spaces or commas. Blank lines and lines
+    starting with # are skipped.
+    """
+    decks = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            decks.append([int(card) for card in line.strip("[]").replace(",", " ").split()])
+    return decks
+
+algorithms = ("ida", "parallel_ida", "bfs", "astar", "greedy", "random", "monte_carlo")
+
+def solve_deck(index, deck, algorithm, cards_per_suit, timeout=None, max_nodes=None,
+               seed=None, rollouts=1000, level=1, ida_workers=None, split_depth=2,
+               **options):
+    """
+    Solves a single deck with algorithm (one of algorithms), with the
+    statuses of Calculation.solve(). options are passed on to Calculation,
+    seed seeds the random player and Monte Carlo search, rollouts and
+    level are for Monte Carlo search, and ida_workers and split_depth are
+    for parallel_ida (see play_parallel_ida()).
+    """
+    if algorithm not in algorithms:
+        raise ValueError("Unknown algorithm: {}".format(algorithm))
+    if algorithm == "astar":
+        options["astar"] = True
+    calculation = Calculation(cards_per_suit, deck, max_nodes=max_nodes, verbose=False,
+                              **options)
+    kwargs = {}
+    if algorithm == "monte_carlo":
+        kwargs = {"rollouts": rollouts, "level": level}
+    elif algorithm == "parallel_ida":
+        kwargs = {"workers": ida_workers, "split_depth": split_depth}
+    try:
+        result = calculation.solve(algorithm, timeout, rng=random.Random(seed), **kwargs)
+    finally:
+        calculation.save_endgames()
+
+    moves = None if result.board is None else result.board.moves
+    return SolveResult(index, deck, result.status, moves, result.nodes, result.elapsed)
+
+def solve_many(decks, algorithm="ida", cards_per_suit=13, workers=None,
+               timeout=None, max_nodes=None, skip=(), **options):
+    """
+    Solves every deck across a pool of worker processes (workers=None uses
+    every core, workers=1 solves them in this process). SolveResults are
+    yielded as soon as each deck is done, so they come back out of order;
+    result.index is the position of its deck in decks. timeout (seconds) and
+    max_nodes apply to each deck separately. Decks whose tuple is in skip
+    (e.g. ResultWriter.done) are left out. Everything else in options goes
+    to solve_deck().
+
+    Only a few decks per worker are handed to the pool at a time, so a long
+    batch never holds more than that many results.
+    """
+    jobs = ((i, deck, algorithm, cards_per_suit, timeout, max_nodes)
+            for i, deck in enumerate(decks) if tuple(deck) not in skip)
+    if workers == 1:
+        for job in jobs:
+            yield solve_deck(*job, **options)
+        return
 
-    if len(argv) > 1:
-        print(argv[1])
-        cards_per_suit = int(argv[1])
-        if len(argv) > 2:
-            niters = int(argv[2])
+    with ProcessPoolExecutor(workers) as pool:
+        in_flight = (workers or multiprocessing.cpu_count()) * 4
+        running = set()
+        for job in jobs:
+            running.add(pool.submit(solve_deck, *job, **options))
+            if len(running) < in_flight:
+                continue
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                yield future.result()
+        for future in as_completed(running):
+            yield future.result()
 
-    print("Starting games with {0!s} cards per suit".format(cards_per_suit))
+# Main Function
 
-    nboards = 0
-    decks = []
-    moves = []
-    times = []
-    for i in range(niters):
-        print("Game",i)
-
-        # Play and time a game of calculation
-        calculation = Calculation(cards_per_suit)
-        # calculation = Calculation(cards_per_suit, [1, 2, 3, 4, 1, 2, 4, 6, 4, 7, 7, 1, 3, 5, 4, 7, 1, 6, 5, 5, 3, 7, 5, 6, 6, 3, 2, 2])
-        print("Deck:", calculation.deck)
-        if mode == "bfs":
-            start = time()
-            board = calculation.play_bfs()
-            end = time()
-        elif mode == "ida":
-            start = time()
-            board = calculation.play_ida()
-            end = time()
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Play batches of Calculation games")
+    parser.add_argument("cards_per_suit", type=int, nargs="?", default=5)
+    parser.add_argument("games", type=int, nargs="?", default=1,
+                        help="how many seeded decks to play (ignored with --decks)")
+    parser.add_argument("--algorithm", default="ida", choices=algorithms,
+                        help="astar is best-first search on moves made + heuristic")
+    parser.add_argument("--heuristic", choices=list(Calculation.heuristics),
+                        help="what to order boards by (default: cards_to_go for astar, "
+                             "priority otherwise)")
+    parser.add_argument("--weights", help="JSON file of priority weights (see tuning.py)")
+    parser.add_argument("--optimal", action="store_true",
+                        help="find the fewest moves (astar and ida only, see Calculation)")
+    parser.add_argument("--h-weight", type=float, default=1,
+                        help="weight of the heuristic for astar (over 1 trades optimality for speed)")
+    parser.add_argument("--quick-solve", action="store_true",
+                        help="try a greedy game before searching (see quick_verdict)")
+    parser.add_argument("--ranking", default="short_term", choices=Calculation.rankings,
+                        help="how to order the waste heaps for a drawn card")
+    parser.add_argument("--auto-play", action="store_true",
+                        help="follow every move with the safe foundation moves")
+    parser.add_argument("--no-symmetry", action="store_true",
+                        help="don't treat waste heaps with the same cards as the same board")
+    parser.add_argument("--rollouts", type=int, default=1000,
+                        help="rollouts per deck for monte_carlo")
+    parser.add_argument("--level", type=int, default=1,
+                        help="nesting level for monte_carlo")
+    parser.add_argument("--ida-workers", type=int,
+                        help="processes per deck for parallel_ida (default: every core)")
+    parser.add_argument("--split-depth", type=int, default=2,
+                        help="moves below the root parallel_ida splits the tree at")
+    parser.add_argument("--max-nodes", type=int, help="node budget per deck")
+    parser.add_argument("--timeout", type=float, help="seconds per deck")
+    parser.add_argument("--memory-limit", type=float,
+                        help="MiB for best-first search before spilling to disk")
+    parser.add_argument("--endgame-cards", type=int,
+                        help="solve boards with this many cards to go exactly")
+    parser.add_argument("--endgame-dir", help="keep each deck's endgames in this directory")
+    parser.add_argument("--cache", help="sqlite file of solves to reuse (ida and bfs only)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes to solve decks in (0 for one per core)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the first deck, and of the random player")
+    parser.add_argument("--decks", help="file of decks to play, one per line")
+    parser.add_argument("--output", help="result file (.jsonl, .csv or .bin)")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="overwrite the output instead of skipping decks already in it")
+    args = parser.parse_args(argv[1:])
+    if args.heuristic is None:
+        args.heuristic = "cards_to_go" if args.algorithm == "astar" else "priority"
+    return args
+
+def default_output(args, options):
+    """
+    The result file for args without --output. Resuming skips every deck
+    already in it, so the name ends in a digest of everything that changes
+    what a search finds (Calculation.options() and the budgets), and a run
+    with different settings starts its own file.
+    """
+    deck = [card for card in range(args.cards_per_suit) for suit in range(4)]
+    settings = Calculation(args.cards_per_suit, deck, verbose=False, **options).options()
+    settings.update(algorithm=args.algorithm, timeout=args.timeout, max_nodes=args.max_nodes)
+    if args.algorithm in ("random", "monte_carlo"):
+        settings.update(seed=args.seed)
+    if args.algorithm == "monte_carlo":
+        settings.update(rollouts=args.rollouts, level=args.level)
+    elif args.algorithm == "parallel_ida":
+        settings.update(ida_workers=args.ida_workers, split_depth=args.split_depth)
+    digest = hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:8]
+    return "data/{0}-{1!s}-{2}-{3}.jsonl".format(settings["heuristic"], args.cards_per_suit,
+                                                 args.algorithm, digest)
 
-        # Record all the data to output later
-        decks.append(calculation.deck)
-        moves.append(board.moves)
-        times.append(end-start)
+def main(argv):
+    args = parse_args(argv)
+    cards_per_suit = args.cards_per_suit
+    options = {"heuristic": args.heuristic, "ranking": args.ranking,
+               "auto_play": args.auto_play, "symmetric": not args.no_symmetry,
+               "endgame_cards": args.endgame_cards, "weights": args.weights,
+               "optimal": args.optimal, "h_weight": args.h_weight,
+               "quick_solve": args.quick_solve, "astar": args.algorithm == "astar"}
+    output = args.output
+    if output is None:
+        output = default_output(args, options)
 
-    print("Writing to file...")
+    print("Starting games with {0!s} cards per suit".format(cards_per_suit))
 
-    human_readable(niters, decks, moves, times, cards_per_suit, mode)
+    if args.decks is not None:
+        decks = read_decks(args.decks)
+    else:
+        # Seeded, so that running again with the same output finishes the batch
+        decks = seeded_decks(cards_per_suit, range(args.seed, args.seed + args.games))
+    memory_limit = None if args.memory_limit is None else int(args.memory_limit * 2**20)
+    with ResultWriter(output, resume=not args.no_resume) as writer:
+        if writer.done:
+            print("Resuming", output, "with", len(writer.done), "decks done")
+        else:
+            print("Writing to", output)
+        results = solve_many(decks, args.algorithm, cards_per_suit, args.workers or None,
+                             args.timeout, args.max_nodes, skip=writer.done, seed=args.seed,
+                             rollouts=args.rollouts, level=args.level,
+                             ida_workers=args.ida_workers, split_depth=args.split_depth,
+                             memory_limit=memory_limit, endgame_dir=args.endgame_dir,
+                             cache=args.cache, **options)
+        for result in results:
+            print("Game", result.index, result.status)
+            print("Deck:", result.deck)
+            writer.write(result)
 
 if __name__ == "__main__":
     main(sys.argv)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+import csv                      # for csv result files
+import hashlib                  # for versioning cached solves
+import io                       # for encoding csv rows
+import json                     # for jsonl result files, and lists in csv
+import os                       # for syncing result files to disk
+import os.path                  # for finding the format
+import sqlite3                  # for the solve cache
+import struct                   # for binary result files
+import types                    # for versioning cached solves
+from functools import lru_cache # for sharing cache connections
+from time import time           # for flushing every so often
+
+"""
+Result files for batches of solved decks
+
+A ResultWriter appends one record per deck as soon as it's solved, so a long
+batch never holds its results in memory and loses at most the last few if it
+dies. Opening an existing file picks up where it left off: the decks already
+in it are in writer.done, and a half written record at the end (from a run
+that was killed mid-write) is cut off before anything new is appended.
+
+Records have the fields of calculation.SolveResult. The format comes from the
+file extension:
+    .csv    one row per deck, with the deck and moves as JSON lists
+    .jsonl  one JSON object per line
+    .bin    packed binary, a few bytes per card and one per move
+
+A SolveCache keeps finished solves in sqlite, so the same deck doesn't have
+to be searched again by the same solver.
+"""
+
+FIELDS = ("index", "deck", "status", "moves", "nodes", "elapsed")
+# New statuses go on the end, since .bin files store the index
+STATUSES = ("solved", "unsolvable", "timeout", "nodes", "cancelled", "error", "unsolved",
+            "exhausted")
+
+# index, status, deck length, number of moves (NO_MOVES for None), nodes, elapsed
+BINARY_HEADER = struct.Struct("<IBHHQd")
+BINARY_MAGIC = b"CALCRES1"
+NO_MOVES = 0xFFFF
+
+def result_format(path):
+    """
+    The format of a result file, from its extension
+    """
+    ext = os.path.splitext(path)[1].lstrip(".")
+    if ext not in ResultWriter.formats:
+        raise ValueError("Unknown result format: {}".format(path))
+    return ext
+
+def as_record(result):
+    """
+    A dict of the FIELDS of a SolveResult (or anything with the same fields)
+    """
+    if not isinstance(result, dict):
+        result = result._asdict()
+    return {field: result.get(field) for field in FIELDS}
+
+def clean_record(record):
+    """
+    Puts a record read back from a file in the same shape it was written in:
+    the deck as a list and the moves as a list of (src, dest) tuples
+    """
+    record["deck"] = list(record["deck"])
+    if record["moves"] is not None:
+        record["moves"] = [tuple(move) for move in record["moves"]]
+    return record
+
+def encode_binary(record):
+    moves = record["moves"]
+    n_moves = NO_MOVES if moves is None else len(moves)
+    header = BINARY_HEADER.pack(record["index"], STATUSES.index(record["status"]),
+                                len(record["deck"]), n_moves, record["nodes"],
+                                record["elapsed"])
+    # Piles are 0-8 (8 is the deck), so a move fits in a byte
+    packed = bytes(src << 4 | dest for src, dest in moves or ())
+    return header + bytes(record["deck"]) + packed
+
+def read_binary(f):
+    """
+    Yields (record, end offset) for every complete record in a binary file
+    """
+    if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+        return
+    while True:
+        header = f.read(BINARY_HEADER.size)
+        if len(header) < BINARY_HEADER.size:
+            return
+        index, status, n_deck, n_moves, nodes, elapsed = BINARY_HEADER.unpack(header)
+        deck = f.read(n_deck)
+        moves = f.read(0 if n_moves == NO_MOVES else n_moves)
+        if len(deck) < n_deck or (n_moves != NO_MOVES and len(moves) < n_moves):
+            return
+        yield ({"index": index, "deck": list(deck), "status": STATUSES[status],
+                "moves": None if n_moves == NO_MOVES else [(m >> 4, m & 15) for m in moves],
+                "nodes": nodes, "elapsed": elapsed}, f.tell())
+
+def parse_line(line, fmt):
+    """
+    The record on one line of a csv or jsonl file (without the newline)
+    """
+    if fmt == "jsonl":
+        return json.loads(line)
+    index, deck, status, moves, nodes, elapsed = next(csv.reader([line]))
+    return {"index": int(index), "deck": json.loads(deck), "status": status,
+            "moves": json.loads(moves) if moves else None,
+            "nodes": int(nodes), "elapsed": float(elapsed)}
+
+def read_text(f, fmt):
+    """
+    Yields (record, end offset) for every complete line of a csv or jsonl
+    file opened in binary mode. Stops at the first line that's cut off or
+    doesn't parse.
+    """
+    if fmt == "csv" and not f.readline().endswith(b"\n"):
+        return
+    for line in iter(f.readline, b""):
+        if not line.endswith(b"\n"):
+            return
+        try:
+            record = parse_line(line.decode().rstrip("\r\n"), fmt)
+        except (ValueError, StopIteration):
+            return
+        yield record, f.tell()
+
+def scan(path, fmt):
+    """
+    Yields (record, end offset) for every complete record in path
+    """
+    with open(path, "rb") as f:
+        if fmt == "bin":
+            yield from read_binary(f)
+        else:
+            yield from read_text(f, fmt)
+
+def read_results(path):
+    """
+    Yields every complete record in a result file as a dict
+    """
+    for record, end in scan(path, result_format(path)):
+        yield clean_record(record)
+
+class ResultWriter:
+    """
+    Streams solve results to path. Records are buffered and written out (and
+    synced to disk) every flush_every records or every flush_seconds,
+    whichever comes first, and when the writer is closed. Use it as a
+    context manager so the last batch isn't lost:
+
+        with ResultWriter("data/run.jsonl") as writer:
+            for result in solve_many(decks, skip=writer.done):
+                writer.write(result)
+
+    With resume (the default) an existing file is kept and appended to, and
+    done holds the tuple of every deck already in it. Otherwise it's
+    overwritten.
+    """
+
+    formats = ("csv", "jsonl", "bin")
+
+    def __init__(self, path, resume=True, flush_every=16, flush_seconds=30):
+        self.path = path
+        self.format = result_format(path)
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.buffer = []
+        self.written = 0
+        self.done = set()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        end = 0
+        if resume and os.path.exists(path):
+            for record, end in scan(path, self.format):
+                self.done.add(tuple(record["deck"]))
+        self.file = open(path, "r+b" if end else "wb")
+        if end:
+            # Drop anything after the last complete record
+            self.file.truncate(end)
+            self.file.seek(end)
+        elif self.format == "bin":
+            self.file.write(BINARY_MAGIC)
+        elif self.format == "csv":
+            self.file.write(self.encode(dict(zip(FIELDS, FIELDS)), header=True))
+        self.last_flush = time()
+
+    def encode(self, record, header=False):
+        if self.format == "bin":
+            return encode_binary(record)
+        if self.format == "jsonl":
+            return (json.dumps(record) + "\n").encode()
+        row = [record[field] for field in FIELDS]
+        if not header:
+            row[1] = json.dumps(row[1])
+            row[3] = "" if row[3] is None else json.dumps(row[3])
+        line = io.StringIO()
+        csv.writer(line, lineterminator="\n").writerow(row)
+        return line.getvalue().encode()
+
+    def write(self, result):
+        """
+        Adds one result (a SolveResult or a dict with the same fields)
+        """
+        record = as_record(result)
+        self.buffer.append(self.encode(record))
+        self.done.add(tuple(record["deck"]))
+        if len(self.buffer) >= self.flush_every or time() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(b"".join(self.buffer))
+            self.written += len(self.buffer)
+            self.buffer = []
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_flush = time()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def code_digest(*funcs):
+    """
+    A hash of what funcs do: their bytecode, names and constants (nested
+    functions included), so it changes whenever their code does
+    """
+    digest = hashlib.sha1()
+    def add(code):
+        digest.update(code.co_code)
+        digest.update(repr(code.co_names).encode())
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                add(const)
+            else:
+                digest.update(repr(const).encode())
+    for func in funcs:
+        add(func.__code__)
+    return digest.hexdigest()
+
+class SolveCache:
+    """
+    Finished solves on disk, in an sqlite database at path. Each one is
+    stored under (cards_per_suit, deck, algorithm, version) with its moves
+    (None if the deck can't be won), nodes expanded and seconds taken.
+    version should change whenever the solver would search differently
+    (see code_digest()); putting a solve throws out the ones for the same
+    deck and algorithm from other versions. Several processes can share
+    one cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS solves (
+                               cards_per_suit INTEGER, deck BLOB, algorithm TEXT,
+                               version TEXT, moves BLOB, nodes INTEGER, elapsed REAL,
+                               PRIMARY KEY (cards_per_suit, deck, algorithm, version))""")
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, cards_per_suit, deck, algorithm, version):
+        """
+        The (moves, nodes, elapsed) stored for the deck, or None if it
+        hasn't been solved
+        """
+        row = self.db.execute("SELECT moves, nodes, elapsed FROM solves WHERE cards_per_suit=? "
+                              "AND deck=? AND algorithm=? AND version=?",
+                              (cards_per_suit, bytes(deck), algorithm, version)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        moves, nodes, elapsed = row
+        if moves is not None:
+            moves = [(m >> 4, m & 15) for m in moves]
+        return moves, nodes, elapsed
+
+    def put(self, cards_per_suit, deck, algorithm, version, moves, nodes, elapsed):
+        # Moves are packed a byte each, like in .bin result files
+        packed = None if moves is None else bytes(src << 4 | dest for src, dest in moves)
+        with self.db:
+            self.db.execute("DELETE FROM solves WHERE cards_per_suit=? AND deck=? "
+                            "AND algorithm=? AND version!=?",
+                            (cards_per_suit, bytes(deck), algorithm, version))
+            self.db.execute("INSERT OR REPLACE INTO solves VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (cards_per_suit, bytes(deck), algorithm, version, packed,
+                             nodes, elapsed))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM solves").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+@lru_cache(maxsize=None)
+def open_cache(path):
+    """
+    The SolveCache at path, opened once per process
+    """
+    return SolveCache(path)
@@ -0,0 +1,574 @@
+#!/usr/bin/env python
+import random                           # for zobrist keys
+import heapq                            # for the open list
+import pickle                           # for spilling the frontier to disk
+import tempfile                         # for spill files
+from collections import OrderedDict, deque # for LRU eviction, buckets
+from collections import namedtuple      # for search results
+from functools import lru_cache         # for sharing keys between boards
+from itertools import count             # for breaking priority ties
+from time import perf_counter           # for search stats
+
+"""
+Search helpers shared by the Calculation players
+
+These don't know anything about the rules of Calculation, they're just the
+data structures the searchers use to keep track of boards.
+"""
+
+class BudgetExceeded(Exception):
+    """
+    Raised from inside a search when it goes past its deadline ("timeout") or
+    its node budget ("nodes")
+    """
+    pass
+
+# What a search that was given a budget comes back with, instead of raising
+# BudgetExceeded:
+#     status    "solved", "unsolvable" (searched everything), "exhausted"
+#               (ran out of boards, but skipped some moves on the way),
+#               "unsolved" (a player that doesn't backtrack lost),
+#               "timeout", "nodes" or "cancelled"
+#     board     the winning board, or None
+#     best      the board that got the most cards onto the foundations
+#     nodes     boards expanded
+#     elapsed   seconds
+#     stats     SearchStats.counts(), if the search was keeping stats
+SearchResult = namedtuple("SearchResult",
+                          ["status", "board", "best", "nodes", "elapsed", "stats"])
+
+class ZobristKeys:
+    """
+    Random 64-bit keys for every (pile, depth, card) a waste heap can hold,
+    every length a foundation can have, and every position in the deck.
+    A board's hash is the xor of the keys for everything on it, so a move
+    only has to xor out what it took away and xor in what it added.
+    """
+
+    def __init__(self, cards_per_suit, seed=0):
+        # Seeded so that every process agrees on the hash of a board
+        rng = random.Random(seed * 1000 + cards_per_suit)
+        deck_size = cards_per_suit * 4
+        bits = lambda: rng.getrandbits(64)
+
+        self.found = [[bits() for n in range(cards_per_suit+1)] for f in range(4)]
+        self.waste = [[[bits() for c in range(cards_per_suit)]
+                       for depth in range(deck_size)] for w in range(4)]
+        self.deck = [bits() for i in range(deck_size+1)]
+
+@lru_cache(maxsize=None)
+def zobrist_keys(cards_per_suit):
+    return ZobristKeys(cards_per_suit)
+
+def mix64(h):
+    """
+    Scrambles a 64-bit hash (the splitmix64 finalizer), for combining hashes
+    with + where xor would let equal hashes cancel out
+    """
+    h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return h ^ (h >> 31)
+
+class TranspositionTable:
+    """
+    Remembers the cheapest known cost of every board the search has seen,
+    keyed by the board's 64-bit hash. When capacity is given the table never
+    grows past it, and eviction decides what gets thrown out:
+        lru     drop the entry that was least recently looked at
+        depth   the table is a fixed array of slots (hash % capacity), and a
+                new entry only replaces an old one with a smaller depth
+    """
+
+    evictions = ("lru", "depth")
+
+    def __init__(self, capacity=None, eviction="lru"):
+        if eviction not in TranspositionTable.evictions:
+            raise ValueError("Unknown eviction policy: {}".format(eviction))
+        self.capacity = capacity
+        self.eviction = eviction
+        self.size = 0
+        if capacity is not None and eviction == "depth":
+            self.slots = [None] * capacity
+        else:
+            self.entries = OrderedDict()
+
+    def __len__(self):
+        return self.size
+
+    def get(self, key):
+        """
+        Returns the best known cost for key, or None if it isn't stored
+        """
+        if self.capacity is None:
+            entry = self.entries.get(key)
+        elif self.eviction == "lru":
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        else:
+            entry = self.slots[key % self.capacity]
+            if entry is not None and entry[0] != key:
+                entry = None
+        return None if entry is None else entry[1]
+
+    def put(self, key, cost, depth=0):
+        """
+        Records that key can be reached in cost moves. depth is how much work
+        is left below the board, which is what depth-preferred eviction keeps.
+        """
+        if self.capacity is None:
+            self.size += key not in self.entries
+            self.entries[key] = (key, cost, depth)
+        elif self.eviction == "lru":
+            if key not in self.entries:
+                if self.size == self.capacity:
+                    self.entries.popitem(last=False)
+                else:
+                    self.size += 1
+            self.entries[key] = (key, cost, depth)
+            self.entries.move_to_end(key)
+        else:
+            i = key % self.capacity
+            old = self.slots[i]
+            if old is None:
+                self.size += 1
+            elif old[0] != key and old[2] > depth:
+                return
+            self.slots[i] = (key, cost, depth)
+
+    def seen(self, key, cost):
+        """
+        Whether key has already been reached at least as cheaply as cost
+        """
+        best = self.get(key)
+        return best is not None and best <= cost
+
+class EndgameTable:
+    """
+    Solved endgames: for every position looked up so far, the fewest moves
+    left to win from it, or None if it can't be won. The game decides what
+    the positions (keys) are and when a board is small enough to solve.
+
+    A table only holds positions of one deck, so save() writes the deck out
+    with it and load() starts over empty if the file is for another deck.
+    """
+
+    def __init__(self, deck=None):
+        self.deck = None if deck is None else list(deck)
+        self.entries = {}
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """
+        The moves left from key (None if it can't be won). Only call it
+        for keys that are in the table.
+        """
+        self.hits += 1
+        return self.entries[key]
+
+    def put(self, key, moves):
+        self.entries[key] = moves
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump((self.deck, self.entries), f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path, deck=None):
+        """
+        The table saved at path, or an empty one if there isn't one for deck
+        """
+        table = cls(deck)
+        try:
+            with open(path, "rb") as f:
+                saved_deck, entries = pickle.load(f)
+        except FileNotFoundError:
+            return table
+        if deck is None or saved_deck == table.deck:
+            table.deck = saved_deck
+            table.entries = entries
+        return table
+
+class Frontier:
+    """
+    The open list for best-first search: a plain heapq (no locks, unlike
+    queue.PriorityQueue), popping the lowest priority first and breaking ties
+    in the order things were pushed.
+
+    Each item is pushed under a key (usually the board itself), and the
+    frontier only holds one live entry per key. Pushing a key again with a
+    better priority is a decrease-key: the new entry is pushed and the old
+    one is left in the heap as stale, to be skipped when it comes up.
+    If max_size is given, the worst tenth of the frontier is dropped
+    whenever it grows past that.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.heap = []
+        self.live = {}          # key -> (priority, tiebreak) of its live entry
+        self.tiebreak = count()
+        self.pruned = 0
+
+    def __len__(self):
+        return len(self.live)
+
+    def __bool__(self):
+        return bool(self.live)
+
+    def __contains__(self, key):
+        return key in self.live
+
+    def push(self, key, priority, item):
+        """
+        Adds item unless key is already waiting with an equal or better
+        priority. Returns whether it was added.
+        """
+        old = self.live.get(key)
+        if old is not None and old[0] <= priority:
+            return False
+        entry = (priority, next(self.tiebreak))
+        self.live[key] = entry
+        self._add(entry, key, item)
+        if self.max_size is not None and len(self.live) > self.max_size:
+            self.prune(self.max_size - self.max_size//10)
+        return True
+
+    def pop(self):
+        """
+        Returns the (priority, item) with the lowest priority
+        """
+        while True:
+            priority, tiebreak, key, item = self._take()
+            if self.live.get(key) == (priority, tiebreak):
+                del self.live[key]
+                return priority, item
+
+    def prune(self, size):
+        """
+        Drops the worst entries until only size are left
+        """
+        entries = [e for e in self._entries() if self.live.get(e[2]) == e[:2]]
+        entries.sort()
+        self.pruned += len(entries) - size
+        for priority, tiebreak, key, item in entries[size:]:
+            del self.live[key]
+        self._rebuild(entries[:size])
+
+    def _add(self, entry, key, item):
+        heapq.heappush(self.heap, entry + (key, item))
+
+    def _take(self):
+        return heapq.heappop(self.heap)
+
+    def _entries(self):
+        return self.heap
+
+    def _rebuild(self, entries):
+        self.heap = entries     # sorted lists are already heaps
+
+class BucketFrontier(Frontier):
+    """
+    A Frontier that keeps one FIFO bucket per priority value. Priorities like
+    len_priority and a_star_priority are small integers with lots of ties,
+    so most pushes and pops never touch the (tiny) heap of bucket values.
+    """
+
+    def __init__(self, max_size=None):
+        super().__init__(max_size)
+        self.buckets = {}
+
+    def _add(self, entry, key, item):
+        priority = entry[0]
+        bucket = self.buckets.get(priority)
+        if bucket is None:
+            bucket = self.buckets[priority] = deque()
+            heapq.heappush(self.heap, priority)
+        bucket.append(entry + (key, item))
+
+    def _take(self):
+        while True:
+            bucket = self.buckets[self.heap[0]]
+            if bucket:
+                return bucket.popleft()
+            del self.buckets[heapq.heappop(self.heap)]
+
+    def _entries(self):
+        return [e for bucket in self.buckets.values() for e in bucket]
+
+    def _rebuild(self, entries):
+        self.heap = []
+        self.buckets = {}
+        for entry in entries:
+            self._add(entry[:2], entry[2], entry[3])
+
+class SpillRun:
+    """
+    One sorted run of frontier entries that a SpillFrontier wrote to disk.
+    Entries are pickled in chunks, and only one chunk is read back into
+    memory at a time.
+    """
+
+    def __init__(self, entries, directory=None, chunk_size=256):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.left = 0
+        chunk = []
+        for entry in entries:
+            chunk.append(entry)
+            if len(chunk) == chunk_size:
+                self.write(chunk)
+                chunk = []
+        if chunk:
+            self.write(chunk)
+        self.file.seek(0)
+        self.chunk = []
+        self.next_chunk()
+
+    def __len__(self):
+        return self.left
+
+    def __iter__(self):
+        while self.left:
+            yield self.pop()
+
+    def write(self, chunk):
+        pickle.dump(chunk, self.file, pickle.HIGHEST_PROTOCOL)
+        self.left += len(chunk)
+
+    def next_chunk(self):
+        if self.left:
+            self.chunk = pickle.load(self.file)
+            self.chunk.reverse()    # so popping from the end keeps the order
+        else:
+            self.file.close()
+
+    @property
+    def head(self):
+        return self.chunk[-1]
+
+    def pop(self):
+        entry = self.chunk.pop()
+        self.left -= 1
+        if not self.chunk:
+            self.next_chunk()
+        return entry
+
+class SpillFrontier(Frontier):
+    """
+    A Frontier that never throws boards away: whenever it holds more than
+    max_size entries, the worse half is written to a temporary file (in
+    directory) as a sorted run, and popping merges the runs back in as
+    their entries come up. Memory use stays around max_size entries plus
+    one chunk per run; once there are more than max_runs runs, the smaller
+    half of them are merged into one.
+
+    Spilled entries no longer count as live, so pushing a board again while
+    its old entry is on disk adds a second copy. The searches already skip
+    boards they've expanded, so the extra copy costs a lookup and nothing
+    else.
+    """
+
+    def __init__(self, max_size=None, directory=None, max_runs=16):
+        super().__init__(max_size)
+        self.directory = directory
+        self.max_runs = max_runs
+        self.runs = []
+        self.spilled = 0        # entries written to disk so far
+
+    def __len__(self):
+        return len(self.live) + sum(len(run) for run in self.runs)
+
+    def __bool__(self):
+        return bool(self.live) or bool(self.runs)
+
+    def pop(self):
+        """
+        Returns the (priority, item) with the lowest priority, whether it's
+        in memory or on disk
+        """
+        while True:
+            self._drop_stale()
+            run = min(self.runs, key=lambda run: run.head[:2], default=None)
+            if run is None or (self.heap and self.heap[0][:2] < run.head[:2]):
+                return super().pop()
+            priority, tiebreak, key, item = run.pop()
+            if not run:
+                self.runs.remove(run)
+            # A better copy in memory will come up on its own
+            live = self.live.get(key)
+            if live is None or live[0] > priority:
+                return priority, item
+
+    def prune(self, size):
+        """
+        Spills everything but the best max_size/2 entries (the size asked for
+        is ignored, so that runs are big enough to be worth a file)
+        """
+        keep = self.max_size // 2
+        entries = [e for e in self.heap if self.live.get(e[2]) == e[:2]]
+        entries.sort()
+        spill = entries[keep:]
+        for priority, tiebreak, key, item in spill:
+            del self.live[key]
+        self.heap = entries[:keep]
+        if spill:
+            self.spilled += len(spill)
+            self.runs.append(SpillRun(spill, self.directory))
+        if len(self.runs) > self.max_runs:
+            # Merge the smaller half, so big runs aren't rewritten every time
+            self.runs.sort(key=len)
+            half = len(self.runs) // 2
+            merged = SpillRun(heapq.merge(*self.runs[:half]), self.directory)
+            self.runs = self.runs[half:] + [merged]
+
+    def _drop_stale(self):
+        while self.heap and self.live.get(self.heap[0][2]) != self.heap[0][:2]:
+            heapq.heappop(self.heap)
+
+frontiers = {"heap": Frontier, "bucket": BucketFrontier, "spill": SpillFrontier}
+
+class SearchStats:
+    """
+    Counts what a search does, for working out branching factors and where
+    the time goes. Hand one to a searcher (stats=SearchStats()) and it will
+    report to it:
+        expanded    boards expanded (every visit)
+        generated   children made from them
+        duplicates  boards the transposition table had already seen
+        pruned      boards ruled out as lost
+        thresholds  the threshold of every IDA* iteration, in order
+        timers      seconds spent in "children", "priority" and "hashing"
+                    (transposition table lookups)
+    The searcher only wraps its functions in timers when it's given stats,
+    so a search without stats runs exactly as before.
+
+    If progress_every is given, log gets a progress line (see
+    progress_line()) every progress_every expanded boards.
+    """
+
+    phases = ("children", "priority", "hashing")
+
+    def __init__(self, progress_every=None, log=print):
+        self.thresholds = []
+        self.timers = dict.fromkeys(SearchStats.phases, 0.0)
+        self.progress_every = progress_every
+        self.log = log
+        self.reset()
+
+    def reset(self):
+        """
+        Starts counting again from zero, e.g. for the next search on the
+        same game. The timers are cleared in place, since timed() functions
+        hold on to them.
+        """
+        self.expanded = 0
+        self.generated = 0
+        self.duplicates = 0
+        self.pruned = 0
+        self.thresholds.clear()
+        for phase in self.timers:
+            self.timers[phase] = 0.0
+        self.start = perf_counter()
+
+    @property
+    def iterations(self):
+        return len(self.thresholds)
+
+    @property
+    def branching_factor(self):
+        """
+        Average children per expanded board
+        """
+        return self.generated / self.expanded if self.expanded else 0.0
+
+    def expand(self):
+        self.expanded += 1
+        if self.progress_every and self.expanded % self.progress_every == 0:
+            self.log(self.progress_line())
+
+    def iteration(self, threshold):
+        """
+        Called at the start of every IDA* iteration
+        """
+        self.thresholds.append(threshold)
+
+    def timed(self, phase, func, tally=None):
+        """
+        Wraps func so that the time spent in it is added to timers[phase].
+        If tally names a counter, the length of every result is added to it.
+        """
+        timers = self.timers
+        def timed_func(*args):
+            start = perf_counter()
+            result = func(*args)
+            timers[phase] += perf_counter() - start
+            if tally is not None:
+                setattr(self, tally, getattr(self, tally) + len(result))
+            return result
+        return timed_func
+
+    def watch_table(self, table):
+        """
+        Times table's lookups as hashing, and counts every lookup of a board
+        it has already seen (at least as cheaply) as a duplicate
+        """
+        seen = table.seen
+        timers = self.timers
+        def timed_seen(key, cost):
+            start = perf_counter()
+            hit = seen(key, cost)
+            timers["hashing"] += perf_counter() - start
+            self.duplicates += hit
+            return hit
+        table.seen = timed_seen
+        table.put = self.timed("hashing", table.put)
+        return table
+
+    def merge(self, counts):
+        """
+        Adds in the counts() of a search run somewhere else (e.g. a worker
+        process searching part of the tree)
+        """
+        self.expanded += counts["expanded"]
+        self.generated += counts["generated"]
+        self.duplicates += counts["duplicates"]
+        self.pruned += counts["pruned"]
+        for phase, seconds in counts["timers"].items():
+            self.timers[phase] += seconds
+
+    def counts(self):
+        """
+        Everything counted so far as a plain dict (safe to pickle or dump as
+        JSON)
+        """
+        return {
+            "expanded": self.expanded,
+            "generated": self.generated,
+            "duplicates": self.duplicates,
+            "pruned": self.pruned,
+            "branching_factor": self.branching_factor,
+            "iterations": self.iterations,
+            "thresholds": list(self.thresholds),
+            "timers": dict(self.timers),
+            "elapsed": perf_counter() - self.start,
+        }
+
+    def progress_line(self):
+        elapsed = perf_counter() - self.start
+        line = "expanded {} ({:.0f}/s)  generated {}  b {:.2f}  duplicates {}  pruned {}".format(
+            self.expanded, self.expanded / elapsed if elapsed else 0, self.generated,
+            self.branching_factor, self.duplicates, self.pruned)
+        if self.thresholds:
+            line += "  iteration {} (threshold {})".format(self.iterations, self.thresholds[-1])
+        line += "  " + "  ".join("{} {:.2f}s".format(phase, self.timers[phase])
+                                 for phase in SearchStats.phases)
+        return line
+
+    def __str__(self):
+        return self.progress_line()
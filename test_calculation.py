@@ -0,0 +1,98 @@
+import random                   # for random games
+import pytest                   # for parametrizing over decks
+
+from calculation import Calculation, seeded_decks
+
+"""
+Tests for the rules searches use to skip boards: that a board is_dead()
+says can't be won really can't be, and that the incremental check
+(lost_by_last_move()) agrees with the full one. Also that optimal searches
+find the fewest moves, and that admissible() never overestimates them.
+
+    python -m pytest test_calculation.py
+"""
+
+# The cards_per_suit the checks are tested on, and how many cards can be
+# left to play on a dead board before searching it out gets slow
+SIZES = [(5, 16), (7, 12)]
+
+def winnable(game, board, memo):
+    """
+    Whether board can be won, by trying every move from it
+    """
+    if board not in memo:
+        memo[board] = game.is_winning(board) or any(
+            winnable(game, child, memo)
+            for child in game.next_boards(board, game.ranked_wastes_simple))
+    return memo[board]
+
+def random_games(game, games=20, seed=0):
+    """
+    Every (parent, children) pair along games random games, all the way to
+    the end whether or not they're lost
+    """
+    rng = random.Random(seed)
+    for _ in range(games):
+        board = game.new_board()
+        children = game.next_boards(board, game.ranked_wastes_simple)
+        while children:
+            yield board, children
+            board = rng.choice(children)
+            children = game.next_boards(board, game.ranked_wastes_simple)
+
+def small_games():
+    return [pytest.param(cards_per_suit, deck, cards_to_go,
+                         id="{}-{}".format(cards_per_suit, seed))
+            for cards_per_suit, cards_to_go in SIZES
+            for seed, deck in enumerate(seeded_decks(cards_per_suit, range(5)))]
+
+@pytest.mark.parametrize("cards_per_suit, deck, cards_to_go", small_games())
+def test_dead_boards_cannot_be_won(cards_per_suit, deck, cards_to_go):
+    game = Calculation(cards_per_suit, deck, verbose=False, ranking="simple")
+    memo = {}
+    checked = 0
+    for board, children in random_games(game):
+        for child in children:
+            left = 4*cards_per_suit - sum(child.found_lens)
+            if left <= cards_to_go and game.is_dead(child):
+                assert not winnable(game, child, memo), child.moves
+                checked += 1
+    assert checked > 0
+
+@pytest.mark.parametrize("cards_per_suit, deck, cards_to_go", small_games())
+def test_last_move_check_matches_full_check(cards_per_suit, deck, cards_to_go):
+    game = Calculation(cards_per_suit, deck, verbose=False, ranking="simple")
+    for board, children in random_games(game):
+        if game.is_dead(board):
+            continue
+        for child in children:
+            assert game.lost_by_last_move(child) == game.is_dead(child), child.moves
+
+# Seeded 5-card decks that an exhaustive search wins in well under a second
+OPTIMAL_SEEDS = [0, 2, 3, 5]
+
+@pytest.mark.parametrize("seed", OPTIMAL_SEEDS)
+def test_optimal_finds_fewest_moves(seed):
+    deck = seeded_decks(5, [seed])[0]
+    # Every card to go takes a move, so plain A* on cards_to_go trying every
+    # move is exact
+    exact = Calculation(5, deck, verbose=False, heuristic="cards_to_go", astar=True,
+                        ranking="simple").solve("bfs")
+    assert exact.status == "solved"
+    for algorithm in ("bfs", "ida"):
+        result = Calculation(5, deck, verbose=False, optimal=True).solve(algorithm)
+        assert result.status == "solved"
+        assert result.board.n_moves == exact.board.n_moves, algorithm
+
+@pytest.mark.parametrize("seed", OPTIMAL_SEEDS)
+def test_admissible_is_lower_bound(seed):
+    deck = seeded_decks(5, [seed])[0]
+    game = Calculation(5, deck, verbose=False)
+    checked = 0
+    for board, children in random_games(game):
+        if board.cards_to_go() <= 10 and not game.is_dead(board):
+            fewest = game.endgame(board)
+            if fewest is not None:
+                assert game.admissible(board) <= fewest, board.moves
+                checked += 1
+    assert checked > 0
@@ -0,0 +1,81 @@
+import os                       # for file sizes
+import pytest                   # for parametrizing over formats
+
+from results import ResultWriter, read_results
+
+"""
+Tests for result files: that every format reads back what was written, and
+that a file cut off mid-record (a run killed while writing) is resumed from
+its last complete record.
+
+    python -m pytest test_results.py
+"""
+
+RECORDS = [
+    {"index": 0, "deck": [1, 2, 3, 4, 0, 4, 2, 1, 3, 0, 1, 2, 3, 4, 0, 4, 2, 1, 3, 0],
+     "status": "solved", "moves": [(8, 4), (8, 0), (4, 1)], "nodes": 21, "elapsed": 0.5},
+    {"index": 1, "deck": [1, 2, 3, 4, 3, 0, 1, 4, 2, 2, 0, 3, 1, 4, 4, 0, 3, 2, 1, 0],
+     "status": "unsolvable", "moves": None, "nodes": 1, "elapsed": 0.25},
+    {"index": 2, "deck": [1, 2, 3, 4, 0, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 4, 4, 4, 0],
+     "status": "exhausted", "moves": None, "nodes": 300, "elapsed": 1.0},
+]
+
+def write(path, records, **kwargs):
+    with ResultWriter(str(path), **kwargs) as writer:
+        for record in records:
+            writer.write(record)
+    return writer
+
+def sizes(path, records):
+    """
+    The size of path after each record is written
+    """
+    sizes = []
+    for n in range(len(records)+1):
+        write(path, records[:n], resume=False)
+        sizes.append(os.path.getsize(path))
+    return sizes
+
+@pytest.mark.parametrize("fmt", ResultWriter.formats)
+def test_round_trip(tmp_path, fmt):
+    path = tmp_path / ("run." + fmt)
+    writer = write(path, RECORDS)
+    assert writer.written == len(RECORDS)
+    assert list(read_results(str(path))) == RECORDS
+
+@pytest.mark.parametrize("fmt", ResultWriter.formats)
+def test_resume_cuts_off_partial_record(tmp_path, fmt):
+    path = tmp_path / ("run." + fmt)
+    complete = sizes(path, RECORDS)
+
+    # Lose the end of the last record, as if the run died while writing it
+    with open(path, "r+b") as f:
+        f.truncate(complete[-1] - 3)
+
+    writer = ResultWriter(str(path))
+    assert writer.done == {tuple(r["deck"]) for r in RECORDS[:-1]}
+    assert os.path.getsize(path) == complete[-2]
+    writer.close()
+    assert list(read_results(str(path))) == RECORDS[:-1]
+
+    # Writing the lost record again leaves the file as if nothing happened
+    write(path, RECORDS[-1:])
+    assert list(read_results(str(path))) == RECORDS
+
+@pytest.mark.parametrize("fmt", ResultWriter.formats)
+def test_resume_keeps_complete_file(tmp_path, fmt):
+    path = tmp_path / ("run." + fmt)
+    write(path, RECORDS)
+    size = os.path.getsize(path)
+
+    writer = write(path, [])
+    assert writer.done == {tuple(r["deck"]) for r in RECORDS}
+    assert os.path.getsize(path) == size
+
+@pytest.mark.parametrize("fmt", ResultWriter.formats)
+def test_no_resume_overwrites(tmp_path, fmt):
+    path = tmp_path / ("run." + fmt)
+    write(path, RECORDS)
+    writer = write(path, RECORDS[:1], resume=False)
+    assert writer.done == {tuple(RECORDS[0]["deck"])}
+    assert list(read_results(str(path))) == RECORDS[:1]
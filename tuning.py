@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+import argparse                 # for command line options
+import json                     # for weight files
+import sys                      # for main args
+try:
+    import numpy as np          # for fitting
+except ImportError:
+    np = None
+
+import calculation
+from calculation import Calculation, Weights
+from benchmark import corpus
+from results import read_results
+
+"""
+Heuristic Weight Tuning
+
+Fits the weights of CalculationBoard.priority() to solved games, and picks
+whichever weights make IDA* expand the fewest boards on the benchmark decks:
+
+    python calculation.py 7 200 --seed 1000 --output data/train-7.jsonl
+    python tuning.py fit data/train-7.jsonl --output weights-7.json
+    python calculation.py 7 10 --weights weights-7.json
+
+and compares weight sets on the benchmark decks:
+
+    python tuning.py compare default weights-7.json --sizes 5 7
+
+Two fits are tried:
+    regression  least squares of priority() against the moves each board on
+                a solution still needed
+    ranking     logistic regression on pairs of children, so the child the
+                solution took gets a lower priority than its siblings
+"""
+
+def solution_boards(game, moves):
+    """
+    Every board along a solution, from the start of the game
+    """
+    board = game.new_board()
+    boards = [board]
+    for move in moves:
+        board = game.make_move(board, move)
+        boards.append(board)
+    return boards
+
+def priority_row(board):
+    """
+    board.features() the way priority() weighs them, so that
+    priority() == weights . priority_row(board)
+    """
+    distance, difficulty, evenness, progress = board.features()
+    return (distance, difficulty, evenness, -progress)
+
+def training_data(paths):
+    """
+    Reads every solved game in the result files at paths. Returns
+    (rows, to_go, pairs): the priority_row() of every board on a solution,
+    the moves left after it, and for every move along a solution, the row of
+    each sibling minus the row of the child that was taken.
+    """
+    rows, to_go, pairs = [], [], []
+    for path in paths:
+        for record in read_results(path):
+            if record["status"] != "solved":
+                continue
+            deck = record["deck"]
+            game = Calculation(len(deck)//4, deck, verbose=False)
+            boards = solution_boards(game, record["moves"])
+            for board in boards:
+                rows.append(priority_row(board))
+                to_go.append(len(boards)-1 - board.n_moves)
+            for board, taken in zip(boards, boards[1:]):
+                taken_row = priority_row(taken)
+                for child in game.children(board):
+                    if child != taken and not game.is_lost(child):
+                        pairs.append([s - t for s, t in zip(priority_row(child), taken_row)])
+    return rows, to_go, pairs
+
+def normalized(weights):
+    """
+    Only the order of priorities matters, so weights are scaled to put the
+    biggest one at 1
+    """
+    weights = np.asarray(weights, dtype=float)
+    biggest = np.abs(weights).max()
+    return Weights(*(weights / biggest if biggest else weights).round(4).tolist())
+
+def fit_regression(rows, to_go):
+    """
+    Least squares weights for priority() ~ moves left
+    """
+    x = np.asarray(rows, dtype=float)
+    y = np.asarray(to_go, dtype=float)
+    weights, *_ = np.linalg.lstsq(x, y, rcond=None)
+    return normalized(weights)
+
+def fit_ranking(pairs, steps=500, rate=0.5):
+    """
+    Logistic regression on (sibling - taken) rows, so that siblings come out
+    with a higher priority than the child the solution took
+    """
+    d = np.asarray(pairs, dtype=float)
+    scale = d.std(axis=0)
+    scale[scale == 0] = 1
+    d = d / scale
+    weights = np.ones(d.shape[1])
+    for step in range(steps):
+        margin = d @ weights
+        # Gradient of the mean log(1 + exp(-margin))
+        grad = -(d * (1 / (1 + np.exp(margin)))[:, None]).mean(axis=0)
+        weights -= rate * grad
+    return normalized(weights / scale)
+
+def evaluate(weights, sizes, n_decks=10, seed=0, algorithm="ida", max_nodes=20000, timeout=10):
+    """
+    Solves the benchmark decks with weights. Returns {cards_per_suit:
+    (solved, nodes)}, counting max_nodes for decks that weren't solved.
+    """
+    totals = {}
+    for cards_per_suit in sizes:
+        solved = nodes = 0
+        for deck in corpus(cards_per_suit, n_decks, seed):
+            result = calculation.solve_deck(0, deck, algorithm, cards_per_suit, timeout,
+                                            max_nodes, weights=list(weights))
+            solved += result.status == "solved"
+            nodes += result.nodes if result.status == "solved" else max_nodes
+        totals[cards_per_suit] = (solved, nodes)
+    return totals
+
+def compare(weight_sets, sizes, log=print, **budget):
+    """
+    Evaluates every {name: weights} on the benchmark decks. Returns the name
+    that solved the most with the fewest nodes, and everyone's totals.
+    """
+    results = {}
+    for name, weights in weight_sets.items():
+        results[name] = totals = evaluate(weights, sizes, **budget)
+        if log:
+            log("{:<20} {}  {}".format(name, tuple(weights), "  ".join(
+                "{}: solved {:>3} nodes {:>8}".format(size, *totals[size]) for size in sizes)))
+    score = lambda name: (-sum(s for s, n in results[name].values()),
+                          sum(n for s, n in results[name].values()))
+    return min(results, key=score), results
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Fit and compare priority() weights")
+    commands = parser.add_subparsers(dest="command", required=True)
+    fit = commands.add_parser("fit", help="fit weights to the solved games in result files")
+    fit.add_argument("results", nargs="+", help="result files (see results.py)")
+    fit.add_argument("--output", help="write the best weights to this JSON file")
+    bench = commands.add_parser("compare", help="compare weight files on the benchmark decks")
+    bench.add_argument("weights", nargs="+", help="weight files, or default")
+    for command in (fit, bench):
+        command.add_argument("--sizes", type=int, nargs="+", default=[5, 7],
+                             help="cards per suit to evaluate on")
+        command.add_argument("--decks", type=int, default=10, help="decks per size")
+        command.add_argument("--seed", type=int, default=0, help="seed of the first deck")
+        command.add_argument("--max-nodes", type=int, default=20000, help="node budget per deck")
+        command.add_argument("--timeout", type=float, default=10, help="seconds per deck")
+    args = parser.parse_args(argv[1:])
+    budget = {"n_decks": args.decks, "seed": args.seed, "max_nodes": args.max_nodes,
+              "timeout": args.timeout}
+
+    if args.command == "compare":
+        weight_sets = {name: calculation.load_weights(None if name == "default" else name)
+                       for name in args.weights}
+        best, results = compare(weight_sets, args.sizes, **budget)
+        print("Fewest nodes:", best)
+        return 0
+
+    if np is None:
+        raise ImportError("fitting weights needs numpy")
+    rows, to_go, pairs = training_data(args.results)
+    if not rows:
+        print("No solved games in", " ".join(args.results))
+        return 1
+    print("Fitting to {} boards and {} sibling pairs".format(len(rows), len(pairs)))
+    weight_sets = {"default": Weights(), "regression": fit_regression(rows, to_go)}
+    if pairs:
+        weight_sets["ranking"] = fit_ranking(pairs)
+    best, results = compare(weight_sets, args.sizes, **budget)
+    print("Fewest nodes:", best)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(weight_sets[best]._asdict(), f, indent=1)
+        print("Wrote", args.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))